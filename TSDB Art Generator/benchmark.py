@@ -0,0 +1,204 @@
+'''
+Created on 18 okt. 2026
+
+Benchmark for the rendering pipeline of the SportsDB Art Generator.
+
+Generates its own Art Elements (background, frame and crest PNGs, the TrueType font bundled with Pillow, and a CSV
+with the requested number of rows), then runs a batch job for each art type and measures:
+- The latency of each row (50th, 90th and 99th percentile, and the maximum) and the rows per second.
+- The time spent in each stage: validation (reading and checking the CSV, compiling the job), compositing (overlays
+  and placing layers), text, drop shadows, and encoding/writing the exports, as timed by lib.profiling. Each stage
+  only counts its own time, not the time of the stages it calls.
+- The peak memory (RSS) of the process.
+
+The results are written to a JSON file, which can be compared with the results of another version using --compare.
+
+Usage:
+    python benchmark.py --rows 500 --out results.json
+    python benchmark.py --rows 500 --out new.json --compare results.json
+'''
+
+from PIL import Image, ImageDraw, ImageFont
+import os, os.path, argparse, contextlib, csv, io, json, platform, random, shutil, sys, tempfile, time
+import PIL
+import lib.artworks as artworks
+import lib.profiling as profiling
+
+
+sizes = {'poster': [680, 1000], 'thumb': [1280, 720], 'banner': [1000, 185], 'square': [700, 700]}
+
+# The stages timed by lib.profiling, and the stage of the benchmark they count towards.
+stages = {
+    'csv'         : 'validation',
+    'preflight'   : 'validation',
+    'compile'     : 'validation',
+    'build_record': 'validation',
+    'add_overlay' : 'compositing',
+    'composite'   : 'compositing',
+    'add_text'    : 'text',
+    'drop_shadow' : 'shadow',
+    'encode'      : 'encode'
+    }
+
+
+# Create the Art Elements used by the benchmark jobs in folder.
+def make_fixtures(folder, rows, crests=30):
+
+    rnd = random.Random(1)
+    font = ImageFont.load_default(10)
+    if not isinstance(font, ImageFont.FreeTypeFont):
+        sys.exit("This Pillow has no FreeType support, so there's no TrueType font to benchmark with.")
+    with open(os.path.join(folder, 'font.ttf'), 'wb') as fp:
+        fp.write(font.font_bytes)
+    for arttype, artsize in sizes.items():
+        background = Image.new('RGBA', artsize)
+        draw = ImageDraw.Draw(background)
+        for i in range(40):
+            x, y = rnd.randint(0, artsize[0]), rnd.randint(0, artsize[1])
+            draw.ellipse([x, y, x + rnd.randint(10, 300), y + rnd.randint(10, 300)], fill=(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255), 255))
+        background.save(os.path.join(folder, 'background-{0}.png'.format(arttype)))
+        frame = Image.new('RGBA', artsize, (0, 0, 0, 0))
+        ImageDraw.Draw(frame).rectangle([0, 0, artsize[0] - 1, artsize[1] - 1], outline=(200, 180, 20, 180), width=12)
+        frame.save(os.path.join(folder, 'frame-{0}.png'.format(arttype)))
+        os.makedirs(os.path.join(folder, 'out', arttype), exist_ok=True)
+    for i in range(crests):
+        crest = Image.new('RGBA', (160, 160), (0, 0, 0, 0))
+        ImageDraw.Draw(crest).ellipse([5, 5, 155, 155], fill=(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255), 220))
+        crest.save(os.path.join(folder, 'crest{0}.png'.format(i)))
+    with open(os.path.join(folder, 'batch.csv'), 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['name', 'crest', 'poster', 'thumb', 'banner', 'square'])
+        for row in range(rows):
+            writer.writerow(['Team {0}'.format(row), os.path.join(folder, 'crest{0}.png'.format(row % crests))] +
+                            [os.path.join(folder, 'out', arttype, '{0:06d}.jpg'.format(row)) for arttype in sizes])
+
+
+# The job for an art type, with static layers below and above the batch layers.
+def make_job(folder, arttype):
+
+    artsize = sizes[arttype]
+    font = os.path.join(folder, 'font.ttf')
+    return {arttype: {'csvfile': os.path.join(folder, 'batch.csv'), 'fnexp': arttype, 'commands': [
+        {'overlay' : {'order': 1, 'image': os.path.join(folder, 'background-{0}.png'.format(arttype)), 'pos': [0, 0]}},
+        {'text'    : {'order': 2, 'font': font, 'text': 'TheSportsDB', 'pos': [20, 60], 'size': 40, 'drop': 'true'}},
+        {'boverlay': {'order': 3, 'image': 'crest', 'pos': [artsize[0] - 180, 10]}},
+        {'btext'   : {'order': 4, 'font': font, 'text': 'name', 'pos': [artsize[0] // 2, artsize[1] - 30], 'size': 36, 'just': 'center', 'stroke': 2, 'drop': 'true'}},
+        {'btext'   : {'order': 5, 'font': font, 'text': 'name', 'pos': [40, artsize[1] - 40], 'size': 24, 'rot': 10}},
+        {'overlay' : {'order': 6, 'image': os.path.join(folder, 'frame-{0}.png'.format(arttype)), 'pos': [0, 0]}}
+        ]}}
+
+
+def peak_rss():
+
+    try:
+        import resource
+    except ImportError: # Not available on Windows.
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss # macOS reports bytes, Linux kilobytes.
+
+
+# Run the job for an art type, timing every stage in this process. Rows are rendered and written one by one, without
+# background writers, so each row and stage can be timed.
+def bench_type(folder, arttype):
+
+    job = make_job(folder, arttype)
+    profiling.enable()
+    profiling.reset()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            art = artworks.generate_art(job, writers=0)
+            elapsed = time.perf_counter() - start
+        report = profiling.report()
+    finally:
+        profiling.disable()
+    if 'error' in art.keys():
+        sys.exit("Benchmark job for {0} failed: {1}".format(arttype, art['error']))
+    rows = report['rows']
+    result = {
+        'rows'        : rows['count'],
+        'seconds'     : elapsed,
+        'rows_per_sec': rows['count'] / elapsed if elapsed > 0 else 0.0,
+        'latency_ms'  : {name: rows.get(name, 0.0) for name in ('p50', 'p90', 'p99', 'max')},
+        'stages'      : {stage: 0.0 for stage in sorted(set(stages.values()))},
+        'canvases'    : report['canvases'],
+        'errors'      : len(art.get('errors', []))
+        }
+    for stage, stats in report['stages'].items():
+        if stage in stages.keys():
+            result['stages'][stages[stage]] += stats['self']
+    result['stages']['other'] = max(0.0, elapsed - sum(result['stages'].values()))
+    return result
+
+
+# Run the job for an art type on a pool of worker processes, measuring only the throughput.
+def bench_workers(folder, arttype, workers):
+
+    job = make_job(folder, arttype)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        art = artworks.generate_art(job, workers=workers)
+        elapsed = time.perf_counter() - start
+    return {'workers': workers, 'seconds': elapsed, 'rows_per_sec': len(art.get('art', [])) / elapsed if elapsed > 0 else 0.0}
+
+
+# Print the results next to an earlier result file, as the ratio of the new to the old value.
+def compare(results, filename):
+
+    with open(filename, 'r') as fp:
+        old = json.load(fp)
+    print("Compared with {0} (new / old):".format(filename))
+    for arttype, new in results['types'].items():
+        if arttype not in old['types'].keys():
+            continue
+        before = old['types'][arttype]
+        print("  {0:7} rows/sec {1:6.2f}x   p50 {2:6.2f}x   p99 {3:6.2f}x".format(
+            arttype,
+            new['rows_per_sec'] / before['rows_per_sec'] if before['rows_per_sec'] > 0 else 0.0,
+            new['latency_ms']['p50'] / before['latency_ms']['p50'] if before['latency_ms']['p50'] > 0 else 0.0,
+            new['latency_ms']['p99'] / before['latency_ms']['p99'] if before['latency_ms']['p99'] > 0 else 0.0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the rendering pipeline of the SportsDB Art Generator")
+    parser.add_argument('--rows', type=int, default=200, help="Number of rows in the generated CSV (default 200)")
+    parser.add_argument('--types', default=','.join(sizes), help="Comma separated art types to benchmark (default all)")
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help="Also measure the throughput with N worker processes")
+    parser.add_argument('--fixtures', help="Folder for the generated Art Elements and exports (default a temporary folder)")
+    parser.add_argument('--out', default='benchmark.json', help="Filename for the JSON results (default benchmark.json)")
+    parser.add_argument('--compare', metavar='FILE', help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    arttypes = [arttype.strip().lower() for arttype in args.types.split(',')]
+    for arttype in arttypes:
+        if arttype not in sizes.keys():
+            parser.error("'{0}' is not a valid art type".format(arttype))
+    folder = args.fixtures if args.fixtures else tempfile.mkdtemp(prefix='tsdb-ag-bench-')
+    os.makedirs(folder, exist_ok=True)
+    try:
+        make_fixtures(folder, args.rows)
+        results = {
+            'python' : platform.python_version(),
+            'pillow' : PIL.__version__,
+            'machine': platform.machine(),
+            'rows'   : args.rows,
+            'types'  : {}
+            }
+        for arttype in arttypes:
+            print("Benchmarking {0}s".format(arttype))
+            results['types'][arttype] = bench_type(folder, arttype)
+            if args.workers > 1:
+                results['types'][arttype]['parallel'] = bench_workers(folder, arttype, args.workers)
+            typeresult = results['types'][arttype]
+            print("  {0:.1f} rows/sec, p50 {1:.1f}ms, p99 {2:.1f}ms".format(typeresult['rows_per_sec'], typeresult['latency_ms']['p50'], typeresult['latency_ms']['p99']))
+            print("  " + ", ".join("{0} {1:.2f}s".format(stage, seconds) for stage, seconds in typeresult['stages'].items()))
+        results['peak_rss_kb'] = peak_rss()
+    finally:
+        if not args.fixtures:
+            shutil.rmtree(folder, ignore_errors=True)
+    with open(args.out, 'w') as fp:
+        json.dump(results, fp, indent=1)
+    print("Results written to {0}".format(args.out))
+    if args.compare:
+        compare(results, args.compare)
+    sys.exit(0)
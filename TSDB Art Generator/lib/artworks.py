@@ -4,14 +4,21 @@ Created on 12 nov. 2024
 @author: Raymond Sagius
 '''
 
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import csv, os.path
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, features
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import csv, io, itertools, math, os, os.path, shutil, time, zlib
+import lib.cache as cache
+import lib.manifest as manifest
+import lib.preflight as preflight
+import lib.profiling as profiling
 
 
 defaults = {
     'text'  : {
              'text'  : {'value': '', 'type': 'str'},
-             'font'  : {'value': None, 'type': 'str'},
+             'font'  : {'value': None, 'type': 'str', 'objects': (ImageFont.FreeTypeFont,)},
              'size'  : {'value': 10, 'type': 'int'},
              'just'  : {'value': 'left', 'type': 'str', 'list': ['left', 'right', 'center', 'centre']},
              'pos'   : {'value': [0,0], 'type': 'list', 'length': 2},
@@ -20,73 +27,106 @@ defaults = {
              'color' : {'value': [0,0,0], 'type': 'list', 'length': 3, 'minmax': [0,255]},
              'fill'  : {'value': [255,255,255], 'type': 'list', 'length': 3, 'minmax': [0,255]},
              'drop'  : {'value': 'False', 'type': 'str', 'list': ['true', 'false']},
-             'dcol'  : {'value': [0,0,0], 'type': 'list', 'length': 3, 'minmax': [0,255]}
+             'dcol'  : {'value': [0,0,0], 'type': 'list', 'length': 3, 'minmax': [0,255]},
+             'blur'  : {'value': 4.4, 'type': 'float'}
              },
     'overlay': {
-             'image' : {'value': None, 'type': 'str'},
+             'image' : {'value': None, 'type': 'str', 'objects': (Image.Image,)},
              'pos'   : {'value': [0,0], 'type': 'list', 'length': 2},
              'zoom'  : {'value': 1.0, 'type': 'float'}
+        },
+    'encoder': {
+             'format'     : {'value': 'jpeg', 'type': 'str', 'list': ['jpeg', 'jpg', 'png', 'webp']},
+             'quality'    : {'value': 95, 'type': 'int', 'minmax': [1,100]},
+             'optimize'   : {'value': True, 'type': 'bool'},
+             'progressive': {'value': False, 'type': 'bool'},
+             'subsampling': {'value': 'default', 'type': 'str', 'list': ['default', '4:4:4', '4:2:2', '4:2:0']}
         }
     }
+
+# Built-in encoder profiles, which can be used by name in the job file or on the command line.
+profiles = {
+    'default': {},
+    'draft'  : {'quality': 80, 'optimize': False},
+    'final'  : {'quality': 95, 'optimize': True, 'progressive': True}
+    }
     
             
     
     
 
-def check_files(job, batchtable):
+# Check the export folders and the files used by the job, and collect all problems into one report. Every path is
+# only checked once, using a pool of threads for large batches. Checked is the preflight.Preflight with the paths that
+# were already checked, so jobs sharing a CSV don't check the same files again.
+# Returns an empty dict, or the error listing the problems along with the list of problems.
+def check_files(job, batchtable, checked=None):
+    
+    if checked is None:
+        checked = preflight.Preflight()
+    if 'commands' not in job.keys():
+        return {"error":"No commands in job definition. Nothing to do."}
+    problems = []
     
-    csvfiles = ''
-    # Check for output folder and duplicate export filenames
+    # Collect every path first, so they can all be checked at once.
+    exports = []
     if 'fnexp' in job.keys():
         if job['fnexp'] in batchtable.keys():
-            csvfiles = job['fnexp']
-            filelist = []
-            for fn in batchtable[csvfiles]:
-                if fn not in filelist:
-                    if os.path.isdir(os.path.dirname(fn)):
-                        filelist.append(fn)
-                    else:
-                        return {"error": "Export folder not found. Please make sure '{0}' exists and is writable.".format(os.path.dirname(fn))}
-                else:
-                    return {"error": "Duplicate export filename ({0}) found in CSV, exiting, because this will result in overwritten output".format(fn)}
+            exports = batchtable[job['fnexp']]
+        elif len(batchtable) > 0:
+            problems.append("Column name {0} not found in the CSV.".format(job['fnexp']))
         else:
-            if len(batchtable) > 0:
-                return {"error": "Column name {0} not found in the CSV.".format(job['fnexp'])}
-            if not os.path.isdir(os.path.dirname(job['fnexp'])):
-                return {"error": "Export folder not found. Please make sure {0} exists and is writable.".format(os.path.dirname(job['fnexp']))}
-                
-    # Loop through each command and check for file availability
-    if 'commands' not in job.keys():
-        return {"error":"No commands in job definition. Nothing to do."}
-    else:
-        commands = job['commands']
-        for command in commands:
-            ctype = list(command)[0]
-            match ctype:
-                case 'overlay':
-                    if not os.path.isfile(command[ctype]['image']):
-                        return {"error":"Overlay file {0} not found. Make sure any referenced overlays exist.".format(command[ctype]['image'])}
-                case 'boverlay':
-                    if not os.path.isfile(command[ctype]['image']):
-                        if not command[ctype]['image'] in batchtable.keys():
-                            return {"error":"Boverlay column '{0}' not found. Exiting.".format(command[ctype]['image'])}
-                        else:
-                            for fp in batchtable[command[ctype]['image']]:
-                                if not os.path.isfile(fp) and fp != '':
-                                    return {"error":"Overlay file {0} not found. Make sure any referenced overlays exist.".format(fp)}
-                    else:
-                        return {"error":"Boverlay has a direct file reference to '{0}'. Use 'overlay' instead.".format(command[ctype]['image'])}
-                case 'text':
-                    if not os.path.isfile(command[ctype]['font']):
-                        return {"error":"Font file {0} not found. Make sure any referenced fonts exist.".format(command[ctype]['font'])}    
-                case 'btext':
-                    if not os.path.isfile(command[ctype]['font']):
-                        if not command[ctype]['image'] in batchtable.keys():
-                            return {"error":"Font column or file '{0}' not found. Exiting.".format(command[ctype]['font'])}
-                        else:
-                            for fp in batchtable[command[ctype]['font']]:
-                                if not os.path.isfile(fp) and fp != '':
-                                    return {"error":"Overlay file {0} not found. Make sure any referenced overlays exist.".format(fp)}    
+            exports = [job['fnexp']]
+    paths = set(os.path.dirname(fn) for fn in exports)
+    for command in job['commands']:
+        ctype = list(command)[0]
+        key = 'image' if ctype in ('overlay', 'boverlay') else 'font'
+        if ctype in ('overlay', 'boverlay', 'text', 'btext') and isinstance(command[ctype][key], str): # Not a loaded image or font.
+            paths.add(command[ctype][key])
+            if ctype in ('boverlay', 'btext') and command[ctype][key] in batchtable.keys():
+                paths.update(batchtable[command[ctype][key]])
+    paths.discard('')
+    checked.check(paths)
+    
+    # Check for output folders and duplicate export filenames
+    for folder in dict.fromkeys(os.path.dirname(fn) for fn in exports):
+        if not checked.isdir(folder):
+            problems.append("Export folder not found. Please make sure '{0}' exists and is writable.".format(folder))
+    for fn in preflight.duplicates(exports):
+        problems.append("Duplicate export filename ({0}) found in CSV, exiting, because this will result in overwritten output".format(fn))
+    
+    # Check each command for file availability
+    for command in job['commands']:
+        ctype = list(command)[0]
+        match ctype:
+            case 'overlay':
+                if isinstance(command[ctype]['image'], str) and not checked.isfile(command[ctype]['image']):
+                    problems.append("Overlay file {0} not found. Make sure any referenced overlays exist.".format(command[ctype]['image']))
+            case 'boverlay':
+                if not isinstance(command[ctype]['image'], str):
+                    problems.append("Boverlay has an image instead of a column name. Use 'overlay' instead.")
+                elif checked.isfile(command[ctype]['image']):
+                    problems.append("Boverlay has a direct file reference to '{0}'. Use 'overlay' instead.".format(command[ctype]['image']))
+                elif not command[ctype]['image'] in batchtable.keys():
+                    problems.append("Boverlay column '{0}' not found. Exiting.".format(command[ctype]['image']))
+                else:
+                    for fp in batchtable[command[ctype]['image']]:
+                        if fp != '' and not checked.isfile(fp):
+                            problems.append("Overlay file {0} not found. Make sure any referenced overlays exist.".format(fp))
+            case 'text':
+                if isinstance(command[ctype]['font'], str) and not checked.isfile(command[ctype]['font']):
+                    problems.append("Font file {0} not found. Make sure any referenced fonts exist.".format(command[ctype]['font']))
+            case 'btext':
+                if not isinstance(command[ctype]['font'], str) or checked.isfile(command[ctype]['font']):
+                    continue
+                if not command[ctype]['font'] in batchtable.keys():
+                    problems.append("Font column or file '{0}' not found. Exiting.".format(command[ctype]['font']))
+                else:
+                    for fp in batchtable[command[ctype]['font']]:
+                        if fp != '' and not checked.isfile(fp):
+                            problems.append("Font file {0} not found. Make sure any referenced fonts exist.".format(fp))
+    if len(problems) > 0:
+        problems = list(dict.fromkeys(problems))
+        return {"error": preflight.report(problems), "problems": problems}
     return {}
 
 
@@ -119,24 +159,57 @@ def check_csv(job):
     return batchtable
 
 
+# Read only the headers of the csvfile. The rows are read one at a time while rendering, using stream_csv.
+def check_csv_headers(job):
+    
+    headers = []
+    if 'csvfile' in job.keys():
+        if os.path.isfile(job['csvfile']):
+            try:
+                with open(job['csvfile']) as csvfile:
+                    csvdata = csv.reader(csvfile, delimiter=',', quotechar='"')
+                    headers = next(csvdata, [])
+            except Exception as e:
+                return {"error":"Error reading csv file: {0}".format(e)}
+    return {'headers': headers}
+
+
+# Yield the rows of the csvfile one at a time, skipping the headers.
+def stream_csv(job):
+    
+    with open(job['csvfile']) as csvfile:
+        csvdata = csv.reader(csvfile, delimiter=',', quotechar='"')
+        next(csvdata, None)
+        for row in csvdata:
+            yield row
+
+
+# Check a single row just before it's rendered, when the CSV is streamed instead of checked up front.
+# Seen keeps the export filenames of the earlier rows, and the paths that were checked for them. Returns an error, or None if the row is fine.
+def check_row(plan, headers, seen, row):
+    
+    if len(row) < len(headers):
+        return "Row has {0} columns, but the CSV has {1} columns.".format(len(row), len(headers))
+    fn = row[plan.column]
+    if fn in seen['names']:
+        return "Duplicate export filename ({0}) found in CSV, skipping this row, because this will result in overwritten output".format(fn)
+    if not seen['paths'].isdir(os.path.dirname(fn)):
+        return "Export folder not found. Please make sure '{0}' exists and is writable.".format(os.path.dirname(fn))
+    error = check_extension(fn, plan.encoder)
+    if error is not None:
+        return error
+    seen['names'].add(fn)
+    for step in plan.steps:
+        if step.command == 'boverlay' and row[step.column] != '' and not seen['paths'].isfile(row[step.column]):
+            return "Overlay file {0} not found. Make sure any referenced overlays exist.".format(row[step.column])
+    return None
+
+
 
 def sort_commands(commandlist):
     
-    results = []
-    for command in commandlist:
-        name = list(command)[0]
-        if len(results) == 0:
-            results.append(command)
-            continue
-        else:
-            for result in results:
-                resname = list(result)[0]
-                if int(command[name]['order']) < int(result[resname]['order']):
-                    results.insert(results.index(result), command)
-                    break
-            if command not in results:
-                results.append(command)
-    return results
+    # sorted is stable, so commands with an equal order keep the order in which they were given.
+    return sorted(commandlist, key=lambda command: int(command[list(command)[0]]['order']))
 
 
 # Add an image on top of the artwork
@@ -146,58 +219,126 @@ def add_overlay(art, img, pos, zoom):
         return art
     # print("Adding image {0} to artwork at position ({1}, {2})".format(img, pos[0], pos[1]))
     result = art
-    ol = Image.open(img)
-    if zoom != 1.0:
-        ol.resize([int(ol.width * zoom), int(ol.height * zoom)], resample=Image.Resampling.LANCZOS)
-    result.paste(ol, pos.copy(), ol)
+    ol = load_overlay(img, zoom)
+    result = place(result, ol, pos)
     return result
 
 
+# Load an overlay image, decoded and zoomed. The same image is only read from disk again if it's been modified.
+# Img can also be an image that's already loaded, which isn't cached.
+def load_overlay(img, zoom):
+    
+    if isinstance(img, Image.Image):
+        ol = img.convert('RGBA')
+        if zoom != 1.0:
+            ol = ol.resize([int(ol.width * zoom), int(ol.height * zoom)], resample=Image.Resampling.LANCZOS)
+        return ol
+    key = cache.file_key(img, zoom)
+    ol = cache.overlays.get(key)
+    if ol is None:
+        with Image.open(img) as fp:
+            ol = fp.convert('RGBA')
+        if zoom != 1.0:
+            ol = ol.resize([int(ol.width * zoom), int(ol.height * zoom)], resample=Image.Resampling.LANCZOS)
+        cache.overlays.put(key, ol)
+    return ol
+
+
 
-# Add text on top of the artwork
-def add_text(art, text, font, size, just, pos, rotation, stroke, color, fill, dropshadow, dropcolor):
+# Add text on top of the artwork, using a loaded font, a text anchor and (r,g,b) tuples for the colors.
+def add_text(art, text, font, anchor, pos, rotation, stroke, color, fill, dropshadow, dropcolor, dropblur):
     
-    dropshadow = dropshadow == "True"
     if text == '': # Text value is empty for this layer, skip it.
         return art
     #print("Adding '{0}' to the artwork.".format(text))
     result = art
-    textimage = Image.new('RGBA', art.size)
+    # Create the drop shadow first if true:
+    if dropshadow:
+        drop, droppos = drop_shadow(pos, text, dropcolor, font, anchor, rotation, dropblur)
+        result = place(result, drop, droppos)
+    
+    # Now place the text. Only the area around the text is drawn and smoothed, with a margin for the resampling.
+    textsize, origin, textpos = text_box(pos, text, font, anchor, rotation, 4, stroke)
+    textimage = Image.new('RGBA', textsize)
     ol = ImageDraw.Draw(textimage)
-    font = ImageFont.truetype(font, size)
-    match just:
+    ol.text(textpos, text, fill=fill, font=font, anchor=anchor, stroke_width=stroke, stroke_fill=color)
+    if rotation % 360 != 0:
+        textimage = textimage.rotate(angle=rotation, center=textpos)
+    textimage = textimage.resize([textimage.width * 2, textimage.height * 2], resample=Image.Resampling.LANCZOS)
+    textimage = textimage.resize([textimage.width // 2, textimage.height // 2], resample=Image.Resampling.LANCZOS)
+    result = place(result, textimage, origin)
+    return result
+
+
+# Composite a layer on top of the artwork with its top left corner at pos. Anything outside the artwork is cut off.
+def place(art, layer, pos):
+    
+    left, top = max(pos[0], 0), max(pos[1], 0)
+    right, bottom = min(pos[0] + layer.width, art.width), min(pos[1] + layer.height, art.height)
+    if right <= left or bottom <= top: # The layer is completely outside of the artwork.
+        return art
+    art.alpha_composite(layer, dest=(left, top), source=(left - pos[0], top - pos[1], right - pos[0], bottom - pos[1]))
+    return art
+
+
+# The text anchor for a justification, on the baseline of the text.
+def text_anchor(just):
+    
+    match just.lower():
         case "left":
-            anchor = 'ls'
+            return 'ls'
         case "right":
-            anchor = 'rs'
+            return 'rs'
         case "center" | "centre":
-            anchor = 'ms'
+            return 'ms'
         case _:
-            anchor = 'ls'
-    # Create the drop shadow first if true:
-    if dropshadow:
-        drop = drop_shadow(result, pos, text, dropcolor, font, anchor, rotation)
-        
-        result.paste(drop, drop)
+            return 'ls'
+
+
+# Load a TrueType font at the given size. The font file is only parsed again if it's been modified.
+# Font can also be a font that's already loaded, which is used at the given size. This is a variant of the font if the
+# size differs, so compile_job passes the size of the font itself when the command doesn't give one.
+def load_font(font, size):
     
-    # Now place the text
-    ol.text(pos, text, fill=tuple(fill), font=font, anchor=anchor, stroke_width=stroke, stroke_fill=tuple(color))
-    textimage = textimage.rotate(angle=rotation, center=pos)
-    textimage = textimage.resize([textimage.width * 2, textimage.height * 2], resample=Image.Resampling.LANCZOS)
-    textimage = textimage.resize([textimage.width // 2, textimage.height // 2], resample=Image.Resampling.LANCZOS)
-    result.paste(textimage, textimage)
+    if isinstance(font, ImageFont.FreeTypeFont): # Already loaded, so only the size can change.
+        return font if font.size == size else font.font_variant(size=size)
+    key = cache.file_key(font, size)
+    result = cache.fonts.get(key)
+    if result is None:
+        result = cache.fonts.put(key, ImageFont.truetype(font, size))
     return result
 
-# Create an image containing the drop shadow of the text.
-def drop_shadow(art, pos, text, color, font, anchor, rotation):
+
+# Determine the area needed to draw text around pos, with a margin on all sides. If the text is rotated, the area is
+# a square centered on pos that fits the text at any angle. Returns the size of the area, its top left corner in the
+# artwork, and the position to draw the text at within the area. Pos can be fractional: the corner of the area is
+# always a whole pixel, and the fraction is kept in the position of the text within the area.
+def text_box(pos, text, font, anchor, rotation, margin, stroke=0):
+    
+    left, top, right, bottom = font.getbbox(text, anchor=anchor, stroke_width=stroke)
+    whole = [math.floor(pos[0]), math.floor(pos[1])]
+    if rotation % 360 == 0:
+        size = [right - left + 2 * margin, bottom - top + 2 * margin]
+        origin = [whole[0] + left - margin, whole[1] + top - margin]
+    else:
+        radius = math.ceil(max(math.hypot(x, y) for x in (left, right) for y in (top, bottom))) + margin
+        size = [2 * radius, 2 * radius]
+        origin = [whole[0] - radius, whole[1] - radius]
+    return size, origin, [pos[0] - origin[0], pos[1] - origin[1]]
+
+
+# Create an image containing the drop shadow of the text, blurred with the given radius. Only the area around the
+# text is drawn and blurred. Returns the shadow and the position to place it at.
+def drop_shadow(pos, text, color, font, anchor, rotation, radius):
     
-    drop = Image.new('RGBA', art.size)
+    size, origin, textpos = text_box(pos, text, font, anchor, rotation, math.ceil(radius * 3) + 1)
+    drop = Image.new('RGBA', size)
     draw = ImageDraw.Draw(drop)
-    draw.text(pos, text, fill=tuple(color), font=font, anchor=anchor)
-    for i in range(7):
-        drop = drop.filter(ImageFilter.BLUR)
-    drop = drop.rotate(angle=rotation, center=pos)
-    return drop
+    draw.text(textpos, text, fill=color, font=font, anchor=anchor)
+    drop = drop.filter(ImageFilter.GaussianBlur(radius))
+    if rotation % 360 != 0:
+        drop = drop.rotate(angle=rotation, center=textpos)
+    return drop, origin
     
 
 # Validate the values of the command, fill in the default value if illegal value or not present
@@ -208,7 +349,8 @@ def build_record(inp, ctype):
         if var not in inp.keys():
             result[var] = defaults[ctype][var]['value']
             continue
-        if type(inp[var]).__name__ != defaults[ctype][var]['type']:
+        # Besides the type, some values can be objects, such as a loaded font instead of the path to the font file.
+        if type(inp[var]).__name__ != defaults[ctype][var]['type'] and not isinstance(inp[var], defaults[ctype][var].get('objects', ())):
             result[var] = defaults[ctype][var]['value']
             if 'errors' not in result.keys():
                 result['errors'] = []
@@ -233,6 +375,7 @@ def build_record(inp, ctype):
                     result['errors'].append("Length of list {0} not allowed. Should be length {1}".format(inp[var], defaults[ctype][var]['length']))
                     continue
             if 'minmax' in defaults[ctype][var].keys():
+                values = []
                 for val in inp[var]:
                     if val < defaults[ctype][var]['minmax'][0]:
                         if 'errors' not in result.keys():
@@ -245,151 +388,652 @@ def build_record(inp, ctype):
                             result['errors'] = []
                         result['errors'].append("Decreased {0} value {1} to maximum of {2}".format(var, val, defaults[ctype][var]['minmax'][1]))
                         val = defaults[ctype][var]['minmax'][1]
+                    values.append(val)
+                result[var] = values
+                continue
             result[var] = inp[var]
             continue
+        if 'minmax' in defaults[ctype][var].keys():
+            if inp[var] < defaults[ctype][var]['minmax'][0] or inp[var] > defaults[ctype][var]['minmax'][1]:
+                result[var] = min(max(inp[var], defaults[ctype][var]['minmax'][0]), defaults[ctype][var]['minmax'][1])
+                if 'errors' not in result.keys():
+                    result['errors'] = []
+                result['errors'].append("Changed {0} value {1} to {2}, to fit between {3} and {4}".format(var, inp[var], result[var], defaults[ctype][var]['minmax'][0], defaults[ctype][var]['minmax'][1]))
+                continue
         result[var] = inp[var]            
     return result
 
-# This checks the job descriptions for validity and ultimately renders the image to return.
-def generate_art(job):
+
+# The encoder settings for the exports. Name is the profile name used in the summary, format and mode are the
+# format to save in and the mode to convert to first, and params are the parameters for saving.
+Encoder = namedtuple('Encoder', ['name', 'format', 'mode', 'params'])
+
+# The extensions of the export filenames for each format, so a jpeg isn't written into a file named .png.
+extensions = {'JPEG': ['.jpg', '.jpeg'], 'PNG': ['.png'], 'WEBP': ['.webp']}
+
+
+# Check if the extension of an export filename matches the format of the encoder. Returns an error, or None.
+def check_extension(fn, encoder):
     
-    print("------------------------------------------------------------")
-    result = {}
-    artsize = [0,0] # start with a 0-size canvas
-    arttype = list(job)[0].lower()
+    if os.path.splitext(fn)[1].lower() in extensions[encoder.format]:
+        return None
+    return "Export filename {0} doesn't match the {1} format of the encoder. Use the extension {2}.".format(fn, encoder.format.lower(), " or ".join(extensions[encoder.format]))
+
+
+# Compile the encoder settings of a job, with the settings given on the command line on top. Either can be the name
+# of a profile, or a dict with the settings to change.
+def compile_encoder(encoder, override=None):
+    
+    messages = []
+    name = 'default'
+    settings = {}
+    for spec in (encoder, override):
+        if spec is None:
+            continue
+        if isinstance(spec, str):
+            if spec.lower() not in profiles.keys():
+                return {'error': "Encoder profile '{0}' not found. Use one of {1}, or give the settings.".format(spec, list(profiles))}
+            name = spec.lower()
+            settings = profiles[name].copy()
+        elif isinstance(spec, dict):
+            settings.update(spec)
+            name = None
+        else:
+            return {'error': "Encoder should be the name of a profile or a dict with settings, not {0}.".format(type(spec).__name__)}
+    inp = build_record(settings, 'encoder')
+    if 'errors' in inp.keys():
+        messages.append("The following errors occurred while checking the encoder settings:")
+        messages.extend(inp['errors'])
+    fmt = inp['format'].lower()
+    match fmt:
+        case "jpeg" | "jpg":
+            fmt, mode = "JPEG", "YCbCr"
+            params = {'quality': inp['quality'], 'optimize': inp['optimize'], 'progressive': inp['progressive']}
+            if inp['subsampling'] != 'default':
+                params['subsampling'] = inp['subsampling']
+        case "png":
+            fmt, mode = "PNG", "RGB"
+            params = {'optimize': inp['optimize']}
+        case "webp":
+            if not features.check('webp'):
+                return {'error': "WebP export isn't supported by the installed version of Pillow."}
+            fmt, mode = "WEBP", "RGB"
+            params = {'quality': inp['quality'], 'method': 6 if inp['optimize'] else 4}
+    if name is None: # Not a profile as is, so describe the settings instead.
+        name = " ".join([fmt.lower()] + ["{0}={1}".format(key, value) for key, value in sorted(params.items())])
+    return {'encoder': Encoder(name, fmt, mode, params), 'messages': messages}
+
+
+# A render plan is a job compiled for one art type. The commands are sorted and validated, and their parameters are
+# resolved into the arguments for add_overlay or add_text. The column of a step is the index of its CSV column for
+# batch commands, which replaces the first argument for each row, or None for commands that are the same every row.
+Plan = namedtuple('Plan', ['arttype', 'artsize', 'fnexp', 'column', 'steps', 'encoder'])
+Step = namedtuple('Step', ['command', 'order', 'func', 'args', 'column'])
+
+
+# Compile the job for an arttype into a render plan, using the headers of the CSV to find the batch columns.
+# Parameter errors are reported once for each command, instead of for every row. Encoder overrides the encoder
+# settings of the job. The fonts are loaded here, so a font that can't be loaded is an error for the whole job.
+# A font that's already loaded is used at its own size, unless the command gives a size.
+def compile_job(arttype, artsize, job, headers, encoder=None):
+    
+    compiled = compile_encoder(job.get('encoder'), encoder)
+    if 'error' in compiled.keys():
+        return compiled
+    messages = compiled['messages']
+    columns = {header: index for index, header in enumerate(headers)}
+    column = None
+    if len(headers) > 0:
+        column = columns.get(job.get('fnexp')) # Checked by check_files, unless the artwork isn't exported to a file.
+    steps = []
+    for command in sort_commands(job['commands']):
+        ctype = list(command)[0]
+        match ctype:
+            case "overlay" | "boverlay":
+                inp = build_record(command[ctype], 'overlay')
+                field = 'image'
+            case "text" | "btext":
+                inp = build_record(command[ctype], 'text')
+                field = 'text'
+            case _:
+                messages.append("Unknown command '{0}' with order {1} is skipped.".format(ctype, command[ctype]['order']))
+                continue
+        if 'errors' in inp.keys():
+            messages.append("The following errors occurred while checking parameters for command with order {0}:".format(command[ctype]['order']))
+            messages.extend(inp['errors'])
+        stepcolumn = None
+        if ctype in ('boverlay', 'btext'):
+            if inp[field] not in columns.keys():
+                return {'error': "Column '{0}' for command with order {1} not found in the CSV.".format(inp[field], command[ctype]['order'])}
+            stepcolumn = columns[inp[field]]
+        if field == 'image':
+            args = (inp['image'], tuple(inp['pos']), inp['zoom'])
+            steps.append(Step(ctype, command[ctype]['order'], add_overlay, args, stepcolumn))
+        else:
+            if inp['font'] is None:
+                return {'error': "No font given for command with order {0}.".format(command[ctype]['order'])}
+            size = inp['size']
+            if 'size' not in command[ctype].keys() and isinstance(inp['font'], ImageFont.FreeTypeFont):
+                size = inp['font'].size # A loaded font keeps its own size, unless the command gives one.
+            try:
+                font = load_font(inp['font'], size)
+            except (OSError, ValueError) as e: # Such as a file that isn't a font, or a size of 0.
+                return {'error': "Font {0} could not be loaded for command with order {1}: {2}".format(inp['font'], command[ctype]['order'], e)}
+            args = (
+                inp['text'],
+                font,
+                text_anchor(inp['just']),
+                tuple(inp['pos']),
+                inp['rot'],
+                inp['stroke'],
+                tuple(inp['color']),
+                tuple(inp['fill']),
+                inp['drop'].lower() == 'true',
+                tuple(inp['dcol']),
+                inp['blur'])
+            steps.append(Step(ctype, command[ctype]['order'], add_text, args, stepcolumn))
+    return {'plan': Plan(arttype, tuple(artsize), job.get('fnexp'), column, tuple(steps), compiled['encoder']), 'messages': messages}
+
+
+# Split the steps into the layers that are the same for every row and the layers that depend on the row.
+# Returns the static layers below the first batch step, the steps from the first up to the last batch step,
+# and the static layers above the last batch step.
+def split_steps(steps):
+    
+    batch = [i for i, step in enumerate(steps) if step.column is not None]
+    if len(batch) == 0:
+        return steps, (), ()
+    return steps[:batch[0]], steps[batch[0]:batch[-1] + 1], steps[batch[-1] + 1:]
+
+
+# Render the static layers once. Each row starts with a copy of the base, and the top is placed over it at the end.
+def precompose(plan):
+    
+    bottom, middle, top = split_steps(plan.steps)
+    layers = {'steps': middle, 'top': None}
+    layers['base'] = render_steps(Image.new("RGBA", plan.artsize, "black"), bottom, [])
+    if len(top) > 0:
+        layers['top'] = render_steps(Image.new("RGBA", plan.artsize, (0, 0, 0, 0)), top, [])
+    return layers
+
+
+# Render the steps on top of the artwork, using the values of the given row for the batch steps.
+def render_steps(art, steps, row):
+    
+    for step in steps:
+        args = step.args
+        if step.column is not None:
+            args = (row[step.column],) + args[1:]
+        art = step.func(art, *args)
+    return art
+
+
+# Render a single row of the batch. Returns the filename to export to, any messages for this row, and the artwork.
+def export_row(plan, layers, row):
+    
+    messages = []
+    art = layers['base'].copy()
+    art = render_steps(art, layers['steps'], row)
+    if layers['top'] is not None:
+        art = place(art, layers['top'], [0, 0])
+    if plan.column is not None:
+        fn = row[plan.column]
+    else:
+        fn = plan.fnexp
+    messages.append("Exporting to {0}".format(fn))
+    return fn, messages, art
+
+
+# Encode the artwork into a file object, such as an open export file or a BytesIO.
+def encode_art(art, fp, encoder):
+    
+    art.convert(encoder.mode).save(fp, encoder.format, **encoder.params)
+
+
+# Encode the artwork and write it to the export file. Returns the time it took and the number of bytes written.
+def save_art(art, fn, encoder):
+    
+    start = time.perf_counter()
+    if os.path.isfile(fn) and os.stat(fn).st_nlink > 1: # Linked by copy_art, so writing to it would change the others.
+        os.remove(fn)
+    with open(fn, 'wb') as fp:
+        encode_art(art, fp, encoder)
+        size = fp.tell()
+    return [time.perf_counter() - start, size]
+
+
+# Export a copy of an artwork that was already exported to src, as a hard link if the file system supports it.
+def copy_art(src, fn):
+    
+    if os.path.lexists(fn):
+        os.remove(fn)
+    try:
+        os.link(src, fn)
+    except OSError: # Another file system, or one without hard links.
+        shutil.copyfile(src, fn)
+
+
+# Renders a row and catches any error, so a failing row is reported against that row instead of stopping the batch.
+# Target is the index of the plan in the targets that are rendered together.
+def render_task(plan, layers, runcount, row, save=True, target=0):
+    
+    try:
+        fn, messages, art = export_row(plan, layers, row)
+        if not save:
+            return {'row': runcount, 'target': target, 'art': fn, 'messages': messages, 'image': art}
+        return {'row': runcount, 'target': target, 'art': fn, 'messages': messages, 'encode': save_art(art, fn, plan.encoder)}
+    except Exception as e:
+        return {'row': runcount, 'target': target, 'messages': [], 'error': "{0}".format(e)}
+
+
+# The targets of a worker process. They're set once when the process starts, so they aren't sent along with every row.
+# When profiling, each worker process times its own stages, starting from nothing, and sends them back with its tasks.
+# The cache stats are sent back the same way, counted from when the worker process started rendering.
+worker_targets = None
+worker_cache = {}
+
+def init_worker(targets, profile=False):
+    
+    global worker_targets, worker_cache
+    worker_targets = targets
+    worker_cache = cache.stats()
+    if profile:
+        profiling.enable()
+        profiling.reset()
+
+def worker_task(runcount, row, todo):
+    
+    tasks = []
+    for index in todo:
+        plan, layers = worker_targets[index]
+        tasks.append(render_task(plan, layers, runcount, row, True, index))
+    tasks[-1]['cache'] = (os.getpid(), cache.diff_stats(cache.stats(), worker_cache))
+    if profiling.enabled:
+        tasks[-1]['profile'] = (os.getpid(), profiling.snapshot())
+    return tasks
+
+
+# Check a row for each target before it's rendered. Returns the tasks for the targets that shouldn't be rendered,
+# such as errors or skipped rows, by the index of the target.
+def check_targets(targets, check, runcount, row):
+    
+    skipped = {}
+    if check is not None:
+        for index in range(len(targets)):
+            task = check(index, runcount, row)
+            if task is not None:
+                task['target'] = index
+                skipped[index] = task
+    return skipped
+
+
+# Render all rows for each target, either one by one or spread over a pool of worker processes. A target is a plan
+# and its precomposed layers, and rendering the targets together means each row is only read and checked once.
+# Results are yielded in row order, and in the order of the targets for each row.
+# Rows can be any iterable, and are only taken from it as they're rendered. If check is given, it's called with the
+# target, runcount and row first. If it returns a task, such as an error or a skipped row, that's yielded instead.
+# Rows rendered in this process are only exported if save is set, while worker processes always export their rows.
+def render_rows(targets, rows, workers=1, check=None, save=True):
+    
+    if workers <= 1 or all(plan.column is None for plan, layers in targets):
+        for runcount, row in enumerate(rows):
+            skipped = check_targets(targets, check, runcount, row)
+            for index, (plan, layers) in enumerate(targets):
+                if index in skipped.keys():
+                    yield skipped[index]
+                else:
+                    yield render_task(plan, layers, runcount, row, save, index)
+        return
+    # Keep a limited window of rows in flight, so the results can be handed back in order without piling up.
+    window = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(targets, profiling.enabled)) as pool:
+        for runcount, row in enumerate(rows):
+            skipped = check_targets(targets, check, runcount, row)
+            todo = [index for index in range(len(targets)) if index not in skipped.keys()]
+            window.append((skipped, pool.submit(worker_task, runcount, row, todo) if len(todo) > 0 else None))
+            if len(window) >= workers * 4:
+                yield from finish_tasks(*window.popleft())
+        while window:
+            yield from finish_tasks(*window.popleft())
+
+
+# The tasks of a row in the window, from the checks and from the worker process, in the order of the targets.
+def finish_tasks(skipped, future):
+    
+    tasks = dict(skipped)
+    if future is not None:
+        for task in future.result():
+            tasks[task['target']] = task
+    return [tasks[index] for index in sorted(tasks)]
+
+
+# Encode and write the rendered artworks in background threads, so the next row is rendered while the last ones are
+# written. At most queue artworks wait to be written, after that rendering waits for the oldest one to be written.
+# Tasks are yielded in row order once their artwork is written, with the error of the row if writing failed.
+def write_rows(tasks, targets, writers=1, queue=4):
+    
+    window = deque()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        for task in tasks:
+            if 'image' in task.keys():
+                encoder = targets[task['target']][0].encoder
+                window.append((task, pool.submit(save_art, task.pop('image'), task['art'], encoder)))
+            else: # Already written, or failed or skipped before it got here.
+                window.append((task, None))
+            while len(window) > max(queue, 1):
+                yield finish_write(*window.popleft())
+        while window:
+            yield finish_write(*window.popleft())
+
+
+# Wait for the artwork of a task to be written, and report the error against the row if it couldn't be.
+def finish_write(task, future):
+    
+    if future is not None:
+        try:
+            task['encode'] = future.result()
+        except Exception as e:
+            task['error'] = "{0}".format(e)
+            del task['art']
+    return task
+
+
+# The size of the artwork for an art type, or None if it isn't a valid art type.
+def art_size(arttype):
     
-    # Determine the type of artwork we're creating
     match arttype:
         case "poster":
-            artsize = [680, 1000]
+            return [680, 1000]
         case "thumb":
-            artsize = [1280, 720]
+            return [1280, 720]
         case "banner":
-            artsize = [1000, 185]
+            return [1000, 185]
         case "square":
-            artsize = [700, 700]
+            return [700, 700]
         case _:
-            return {'error': "'{0}' is not a valid art type".format(arttype)}
-    result['artsize'] = artsize
+            return None
+
+
+# Read the CSV of a job for batch execution, if it has one. When streaming, only the headers are read now, and the
+# columns are left empty for check_files.
+def read_batch(job, stream=False):
     
-    # If there is a csvfile for batch execution, try to read it. 
-    batchtable = check_csv(job[arttype])
-    if 'error' in batchtable.keys():
-        return batchtable
+    if stream:
+        csvheaders = check_csv_headers(job)
+        if 'error' in csvheaders.keys():
+            return csvheaders
+        return {header: [] for header in csvheaders['headers']}
+    return check_csv(job)
+
+
+# Check and compile a job for rendering. Returns the plan, with its static layers rendered.
+def prepare_target(arttype, job, batchtable, encoder=None, checked=None):
+    
+    artsize = art_size(arttype)
+    if artsize is None:
+        return {'error': "'{0}' is not a valid art type".format(arttype)}
+    if 'fnexp' not in job.keys(): # Only artworks that aren't written to a file can do without.
+        return {'error': "No fnexp in job definition. Nothing to export to."}
     
-    # Determine where the exports go. Make sure we can export the file(s).
-    chk = check_files(job[arttype], batchtable)
+    # Determine where the exports go. Make sure we can export the file(s). When streaming, the columns are empty,
+    # so only the columns are checked here and the values of each row are checked by check_row.
+    chk = check_files(job, batchtable, checked)
     if 'error' in chk.keys():
         return chk
     
-    # Sort the list of commands by order. This is to fix the order, in case the list isn't ordered on a system.
-    job[arttype]['commands'] = sort_commands(job[arttype]['commands'])
+    # Compile the commands into a render plan. This sorts the commands by order, in case the list isn't ordered on a
+    # system, and checks their parameters once for the whole batch.
+    compiled = compile_job(arttype, artsize, job, list(batchtable), encoder)
+    if 'error' in compiled.keys():
+        return compiled
+    for message in compiled['messages']:
+        print(message)
+    
+    # Now the format is known, check the extensions of the exports. When streaming, these are checked by check_row.
+    plan = compiled['plan']
+    exports = batchtable[plan.fnexp] if plan.column is not None else [plan.fnexp]
+    problems = [error for error in (check_extension(fn, plan.encoder) for fn in exports if fn is not None) if error is not None]
+    if len(problems) > 0:
+        return {'error': preflight.report(problems), 'problems': problems}
+    
+    # Render the layers that are the same for every row only once.
+    return {'plan': compiled['plan'], 'layers': precompose(compiled['plan'])}
+
+
+# Check if an export belongs to a shard, given as (index, count) with index counting from 1. Exports are spread over
+# the shards by a checksum of their filename, so every run puts them in the same shard, and exports with the same
+# filename always end up in the same shard, where they're found as duplicates.
+def in_shard(fn, shard):
+    
+    return zlib.crc32(fn.encode('utf-8')) % shard[1] == shard[0] - 1
+
+
+# Render the rows of a CSV for the targets, and collect the result of each target.
+# With stream set, each row is checked just before it's rendered, as the rows haven't been checked up front.
+# With incremental set, rows are skipped if their inputs haven't changed since the manifest in their export folder.
+# With shard set, only the exports of that shard are rendered, and the manifests of the shard are used.
+# With dedup set, rows whose batch columns are the same as an earlier row aren't rendered again, but the export of the
+# earlier row is linked or copied to their filename.
+def run_targets(targets, headers, rows, workers=1, stream=False, incremental=False, writers=1, queue=4, shard=None, dedup=True):
+    
+    results = []
+    checkrows = []
+    paths = preflight.Preflight()
+    for plan, layers in targets:
+        results.append({'artsize': list(plan.artsize), 'rendered': 0, 'skipped': 0, 'othershards': 0, 'deduplicated': 0,
+                        'encoder': {'profile': plan.encoder.name, 'files': 0, 'seconds': 0.0, 'bytes': 0}})
+        checkrows.append(partial(check_row, plan, headers, {'names': set(), 'paths': paths}) if stream else None)
+    
+    # Check each row before it's rendered, and skip the rows that haven't changed when rendering incrementally.
+    # Firsts holds the first row exported for the values of the batch columns of each target, by the row number.
+    keys = {}
+    firsts = [{} for target in targets]
+    failed = set()
+    exports = None
+    if incremental:
+        exports = manifest.Manifest(manifest.shard_name(*shard) if shard is not None else manifest.MANIFEST)
+    def check(target, runcount, row):
+        plan = targets[target][0]
+        if shard is not None and (plan.column is None or plan.column < len(row)): # Short rows are reported by all shards.
+            if not in_shard(row[plan.column] if plan.column is not None else plan.fnexp, shard):
+                return {'row': runcount, 'messages': [], 'othershard': True}
+        if checkrows[target] is not None and plan.column is not None:
+            error = checkrows[target](row)
+            if error is not None:
+                return {'row': runcount, 'messages': [], 'error': error}
+        fn = row[plan.column] if plan.column is not None else plan.fnexp
+        task = None
+        if exports is not None:
+            key = exports.row_hash(plan, row)
+            if exports.unchanged(fn, key):
+                task = {'row': runcount, 'messages': ["Skipping unchanged {0}".format(fn)], 'art': fn, 'skipped': True}
+            else:
+                keys[(target, runcount)] = key
+        if dedup and plan.column is not None:
+            inputs = tuple(row[step.column] for step in plan.steps if step.column is not None)
+            if task is None and inputs in firsts[target].keys():
+                first = firsts[target][inputs]
+                return {'row': runcount, 'messages': ["Copying {0} to {1}".format(first[1], fn)], 'art': fn, 'copyof': first}
+            firsts[target].setdefault(inputs, (runcount, fn))
+        return task
     
-    # Determine the runcounts
-    if len(batchtable) > 0:
-        batchcount = len(batchtable[list(batchtable)[0]])
-    else:
-        batchcount = 0
-        
     # Start running each image export
-    runcount = 0
-    while True:
-        art = Image.new("RGBA", artsize, "black")
-        for command in job[arttype]['commands']:
-            func = list(command)[0]
-            match func:
-                case "overlay":
-                    inp = {}
-                    inp = command[func].copy()
-                    inp = build_record(inp, 'overlay')
-                    if 'errors' in inp.keys():
-                        print("The following errors occurred while checking parameters for command with order {0}:".format(command[func]['order']))
-                        for error in inp['errors']:
-                            print(error)
-                    art = add_overlay(
-                        art, 
-                        inp['image'], 
-                        inp['pos'],
-                        inp['zoom'])
-                case "boverlay":
-                    inp = {}
-                    inp = command[func].copy()
-                    inp['image'] = batchtable[inp['image']][runcount]
-                    inp = build_record(inp, 'overlay')
-                    if 'errors' in inp.keys():
-                        print("The following errors occurred while checking parameters for command with order {0}:".format(command[func]['order']))
-                        for error in inp['errors']:
-                            print(error)
-                    art = add_overlay(
-                        art, 
-                        inp['image'], 
-                        inp['pos'],
-                        inp['zoom'])
-                case "text":
-                    inp = {}
-                    inp = command[func].copy()
-                    inp = build_record(inp, 'text')
-                    if 'errors' in inp.keys():
-                        print("The following errors occurred while checking parameters for command with order {0}:".format(command[func]['order']))
-                        for error in inp['errors']:
-                            print(error)
-                    art = add_text(
-                        art, 
-                        inp['text'], 
-                        inp['font'],
-                        inp['size'],
-                        inp['just'],
-                        inp['pos'], 
-                        inp['rot'],
-                        inp['stroke'],
-                        inp['color'],
-                        inp['fill'],
-                        inp['drop'],
-                        inp['dcol'])
-                case "btext":
-                    inp = {}
-                    inp = command[func].copy()
-                    inp['text'] = batchtable[inp['text']][runcount]
-                    inp = build_record(inp, 'text')
-                    if 'errors' in inp.keys():
-                        print("The following errors occurred while checking parameters for command with order {0}:".format(command[func]['order']))
-                        for error in inp['errors']:
-                            print(error)
-                    art = add_text(
-                        art, 
-                        inp['text'], 
-                        inp['font'], 
-                        inp['size'],
-                        inp['just'],
-                        inp['pos'], 
-                        inp['rot'],
-                        inp['stroke'],
-                        inp['color'],
-                        inp['fill'],
-                        inp['drop'],
-                        inp['dcol'])
-        if batchcount == 0:
-            print("Exporting to {0}".format(job[arttype]['fnexp']))
-            art = art.convert("YCbCr")
-            with open(job[arttype]['fnexp'], 'wb') as fp:
-                art.save(fp, "JPEG", quality=95, optimize=True)
-                if 'art' not in result.keys():
-                    result['art'] = []
-                result['art'].append(job[arttype]['fnexp'])
+    cachestats = {}
+    tasks = render_rows(targets, rows, workers, check, save=writers <= 0)
+    if writers > 0:
+        tasks = write_rows(tasks, targets, writers, queue)
+    for task in tasks:
+        result = results[task['target']]
+        if 'cache' in task.keys(): # Keep the latest cache stats of each worker process.
+            cachestats[task['cache'][0]] = task['cache'][1]
+        if 'profile' in task.keys():
+            profiling.merge_worker(*task['profile'])
+        if 'othershard' in task.keys():
+            result['othershards'] += 1
+            continue
+        if 'copyof' in task.keys(): # The earlier row has been written by now, as the tasks come in row order.
+            try:
+                if (task['target'], task['copyof'][0]) in failed:
+                    raise OSError("The identical row {0} wasn't exported.".format(task['copyof'][0] + 1))
+                copy_art(task['copyof'][1], task['art'])
+            except OSError as e:
+                task['error'] = "{0}".format(e)
+        for message in task['messages']:
+            print(message)
+        if 'error' in task.keys():
+            print("Error while rendering row {0}: {1}".format(task['row'] + 1, task['error']))
+            if 'errors' not in result.keys():
+                result['errors'] = []
+            result['errors'].append("Row {0}: {1}".format(task['row'] + 1, task['error']))
+            failed.add((task['target'], task['row']))
+            keys.pop((task['target'], task['row']), None)
+            continue
+        if 'art' not in result.keys():
+            result['art'] = []
+        result['art'].append(task['art'])
+        if 'skipped' in task.keys():
+            result['skipped'] += 1
+            continue
+        if 'copyof' in task.keys():
+            result['deduplicated'] += 1
         else:
-            print("Exporting to {0}".format(batchtable[job[arttype]['fnexp']][runcount]))
-            art = art.convert("YCbCr")
-            with open(batchtable[job[arttype]['fnexp']][runcount], 'wb') as fp:
-                art.save(fp, "JPEG", quality=95, optimize=True)
-                if 'art' not in result.keys():
-                    result['art'] = []
-                result['art'].append(batchtable[job[arttype]['fnexp']][runcount])
-        if runcount >= batchcount - 1:
-            break
-        runcount += 1
+            result['rendered'] += 1
+            result['encoder']['files'] += 1
+            result['encoder']['seconds'] += task['encode'][0]
+            result['encoder']['bytes'] += task['encode'][1]
+        if exports is not None:
+            exports.record(task['art'], keys.pop((task['target'], task['row'])))
+    if exports is not None:
+        exports.save()
+    for result in results:
+        result['cache'] = cache.merge_stats(cachestats.values())
+    return results
+
+
+# The rows of a job. Without a CSV there is a single export, which doesn't use any columns.
+def job_rows(job, batchtable, stream=False):
+    
+    if len(batchtable) == 0:
+        return [[]]
+    if stream:
+        return stream_csv(job)
+    return [list(row) for row in zip(*batchtable.values())]
+
+
+# This checks the job descriptions for validity and ultimately renders the image to return.
+# With stream set, the rows of the CSV are read and checked one at a time while rendering, instead of all up front.
+# With incremental set, rows are skipped if their inputs haven't changed since the manifest in their export folder.
+# Writers is the number of threads that encode and write the exports while the next rows are rendered, with at most
+# queue exports waiting. With 0 writers each export is written before the next row is rendered.
+# Encoder overrides the encoder settings of the job, with a profile name or a dict of settings.
+# Shard is (index, count) to only render the exports of that shard, with index counting from 1. The CSV is still read
+# and checked as a whole, so missing files and duplicate filenames are found by every shard.
+# With dedup set, rows that only differ in their export filename are rendered once, and linked or copied to the others.
+# The cache stats of the result only count the hits and misses of this job, in this process and the worker processes.
+def generate_art(job, workers=1, stream=False, incremental=False, writers=1, queue=4, encoder=None, shard=None, dedup=True):
+    
+    print("------------------------------------------------------------")
+    arttype = list(job)[0].lower()
+    before = cache.stats()
+    
+    # If there is a csvfile for batch execution, try to read it.
+    batchtable = read_batch(job[list(job)[0]], stream)
+    if 'error' in batchtable.keys():
+        return batchtable
+    target = prepare_target(arttype, job[list(job)[0]], batchtable, encoder)
+    if 'error' in target.keys():
+        return target
+    rows = job_rows(job[list(job)[0]], batchtable, stream)
+    result = run_targets([(target['plan'], target['layers'])], list(batchtable), rows, workers, stream, incremental, writers, queue, shard, dedup)[0]
+    result['cache'] = cache.merge_stats([cache.diff_stats(cache.stats(), before), result['cache']])
     print("------------------------------------------------------------")    
     return result
 
+
+# Render several jobs together. Jobs that use the same CSV are rendered in a single pass: the CSV is read and its
+# files are checked once, and each row is rendered for all of these jobs before moving on to the next row, sharing
+# the loaded overlays and fonts. Returns the result of each job, in the same order as the jobs.
+# The jobs rendered together share their cache stats, and the indexes of these jobs are in 'together' of their results.
+# The other arguments are the same as for generate_art.
+def generate_multi(jobs, workers=1, stream=False, incremental=False, writers=1, queue=4, encoder=None, shard=None, dedup=True):
     
+    results = [None] * len(jobs)
+    groups = {}
+    for index, job in enumerate(jobs):
+        csvfile = job[list(job)[0]].get('csvfile')
+        groups.setdefault(os.path.abspath(csvfile) if csvfile else None, []).append(index)
+    for csvfile, indexes in groups.items():
+        print("------------------------------------------------------------")
+        before = cache.stats()
+        first = jobs[indexes[0]][list(jobs[indexes[0]])[0]]
+        batchtable = read_batch(first, stream)
+        if 'error' in batchtable.keys():
+            for index in indexes:
+                results[index] = batchtable
+            continue
+        targets = []
+        targetjobs = []
+        checked = preflight.Preflight()
+        for index in indexes:
+            job = jobs[index]
+            target = prepare_target(list(job)[0].lower(), job[list(job)[0]], batchtable, encoder, checked)
+            if 'error' in target.keys():
+                results[index] = target
+                continue
+            targets.append((target['plan'], target['layers']))
+            targetjobs.append(index)
+        if len(targets) == 0:
+            continue
+        print("Rendering {0} together".format(", ".join("{0}s".format(plan.arttype) for plan, layers in targets)))
+        rows = job_rows(first, batchtable, stream)
+        groupresults = run_targets(targets, list(batchtable), rows, workers, stream, incremental, writers, queue, shard, dedup)
+        stats = cache.merge_stats([cache.diff_stats(cache.stats(), before), groupresults[0]['cache']])
+        for index, result in zip(targetjobs, groupresults):
+            result.update({'cache': stats, 'together': targetjobs})
+            results[index] = result
+        print("------------------------------------------------------------")
+    return results
+
+
+# Render the rows of a job in memory, without reading a CSV or writing any files. The job is a single job as in a job
+# file, such as {"poster": {"commands": [...]}}, where overlays and fonts can be loaded images and fonts as well as
+# paths. A loaded font is used at its own size, unless the command gives a size. Rows is an iterable of dicts with a
+# value for each column used by the batch commands. The values for boverlay can be loaded images too. For a job
+# without batch commands, give a single empty row.
+# Yields the artwork of each row as an image, or as bytes encoded with the encoder settings of the job if encode is
+# set. Encoder overrides the encoder settings of the job. Raises ValueError for errors in the job or in a row.
+def render_images(job, rows, encode=False, encoder=None):
     
-    
\ No newline at end of file
+    arttype = list(job)[0].lower()
+    job = {key: value for key, value in job[list(job)[0]].items() if key not in ('csvfile', 'fnexp')}
+    artsize = art_size(arttype)
+    if artsize is None:
+        raise ValueError("'{0}' is not a valid art type".format(arttype))
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    headers = list(first)
+    chk = check_files(job, {header: [] for header in headers})
+    if 'error' in chk.keys():
+        raise ValueError(chk['error'])
+    compiled = compile_job(arttype, artsize, job, headers, encoder)
+    if 'error' in compiled.keys():
+        raise ValueError(compiled['error'])
+    for message in compiled['messages']:
+        print(message)
+    plan = compiled['plan']
+    layers = precompose(plan)
+    for runcount, row in enumerate(itertools.chain([first], rows)):
+        if not all(header in row.keys() for header in headers):
+            raise ValueError("Row {0}: The row should have a value for each of the columns {1}.".format(runcount + 1, headers))
+        values = [row[header] if isinstance(row[header], Image.Image) else "{0}".format(row[header]) for header in headers]
+        task = render_task(plan, layers, runcount, values, False)
+        if 'error' in task.keys():
+            raise ValueError("Row {0}: {1}".format(runcount + 1, task['error']))
+        if not encode:
+            yield task['image']
+            continue
+        fp = io.BytesIO()
+        encode_art(task['image'], fp, plan.encoder)
+        yield fp.getvalue()
@@ -0,0 +1,126 @@
+'''
+Created on 18 okt. 2026
+
+Caches for decoded art elements, so the same files aren't read from disk again for every exported image.
+'''
+
+from collections import OrderedDict
+from threading import Lock
+import os.path
+
+
+# A least recently used cache with a size limit. The size of each item is determined by the weigh function,
+# which counts each item as 1 if it isn't given. When the limit is exceeded the oldest items are removed.
+class LRUCache:
+
+    def __init__(self, maxsize, weigh=None):
+
+        self.maxsize = maxsize
+        self.weigh = weigh if weigh is not None else lambda value: 1
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    # Return the cached value for key, or None if it isn't cached.
+    def get(self, key):
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            self.misses += 1
+            return None
+
+    # Add a value to the cache, and remove the least recently used values until the cache fits again.
+    def put(self, key, value):
+
+        weight = self.weigh(value)
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            if weight > self.maxsize: # Too large to ever fit, don't push everything else out for it.
+                return value
+            self.items[key] = (value, weight)
+            self.size += weight
+            while self.size > self.maxsize:
+                self.size -= self.items.popitem(last=False)[1][1]
+                self.evictions += 1
+        return value
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def stats(self):
+
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'items'    : len(self.items),
+                'size'     : self.size,
+                'maxsize'  : self.maxsize,
+                'hits'     : self.hits,
+                'misses'   : self.misses,
+                'evictions': self.evictions,
+                'hitrate'  : self.hits / total if total > 0 else 0.0
+                }
+
+
+# The approximate memory used by a decoded image.
+def image_bytes(img):
+
+    return img.width * img.height * len(img.getbands())
+
+
+# Decoded overlays, already converted and zoomed. Limited to 512MB of pixel data by default.
+overlays = LRUCache(512 * 1024 * 1024, image_bytes)
+
+# Loaded TrueType fonts by file and size. Fonts are small, so this is limited by count.
+fonts = LRUCache(128)
+
+
+# The stats of all caches, so the hit rates can be checked.
+def stats():
+
+    return {'overlays': overlays.stats(), 'fonts': fonts.stats()}
+
+
+# Combine the stats of the caches in several processes into one.
+def merge_stats(statlist):
+
+    result = {}
+    for cachestats in statlist:
+        for name in cachestats:
+            if name not in result.keys():
+                result[name] = {'items': 0, 'size': 0, 'maxsize': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+            for key in result[name]:
+                result[name][key] += cachestats[name][key]
+    for name in result:
+        total = result[name]['hits'] + result[name]['misses']
+        result[name]['hitrate'] = result[name]['hits'] / total if total > 0 else 0.0
+    return result
+
+
+# The stats of the caches since an earlier snapshot of their stats, so a job only shows its own hits and misses.
+def diff_stats(after, before):
+
+    result = {}
+    for name in after:
+        result[name] = dict(after[name])
+        for key in ('hits', 'misses', 'evictions'):
+            result[name][key] -= before.get(name, {}).get(key, 0)
+        total = result[name]['hits'] + result[name]['misses']
+        result[name]['hitrate'] = result[name]['hits'] / total if total > 0 else 0.0
+    return result
+
+
+# Return the key for a file, which changes whenever the file is modified.
+def file_key(path, *args):
+
+    return (path, os.path.getmtime(path)) + args
@@ -0,0 +1,135 @@
+'''
+Created on 18 okt. 2026
+
+Manifests for incremental rendering. A manifest is stored in each export folder and holds a hash of everything that
+went into each exported file: the art type, the encoder settings, the parameters of every command for that row, and
+the modification time and size of every image and font used. A row whose hash matches the manifest, and whose file
+still exists, doesn't need to be rendered again.
+
+When a batch is split into shards, each shard keeps its own manifest in each folder, so shards running at the same
+time don't overwrite each other's manifest. merge_shards combines them into the manifest of the folder afterwards.
+'''
+
+from PIL import ImageFont
+import hashlib, json, os, os.path
+
+
+MANIFEST = '.tsdb-ag.manifest.json'
+
+
+# The filename of the manifest of a shard, where index counts from 1 to count.
+def shard_name(index, count):
+
+    return '.tsdb-ag.manifest.shard-{0}-of-{1}.json'.format(index, count)
+
+
+# Load a manifest from a file, or return an empty manifest if there isn't one.
+def load(path):
+
+    if os.path.isfile(path):
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            pass # A broken manifest only means everything in the folder is rendered again.
+    return {'outputs': {}}
+
+
+# Write a manifest to a temporary file first, so an interrupted run can't leave a broken manifest behind.
+def save(path, data):
+
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(data, fp, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Combine the manifests of the shards in a folder into the manifest of the folder, and remove them.
+# Returns the number of shard manifests that were merged.
+def merge_shards(folder, count):
+
+    data = load(os.path.join(folder, MANIFEST))
+    merged = 0
+    for index in range(1, count + 1):
+        path = os.path.join(folder, shard_name(index, count))
+        if os.path.isfile(path):
+            data['outputs'].update(load(path)['outputs'])
+            merged += 1
+    if merged > 0:
+        save(os.path.join(folder, MANIFEST), data)
+        for index in range(1, count + 1):
+            if os.path.isfile(os.path.join(folder, shard_name(index, count))):
+                os.remove(os.path.join(folder, shard_name(index, count)))
+    return merged
+
+
+class Manifest:
+
+    # Name is the filename of the manifests that are written. A shard also uses the manifest of the folder, as
+    # merged from the earlier runs, for the files it hasn't exported itself yet.
+    def __init__(self, name=MANIFEST):
+
+        self.name = name
+        self.folders = {}     # The loaded manifest of each export folder.
+        self.bases = {}       # The manifest of each export folder, when this is the manifest of a shard.
+        self.signatures = {}  # The signature of each file used, so each file is only checked once per run.
+
+    # The manifest of a folder, loaded from disk the first time it's used.
+    def folder(self, folder):
+
+        if folder not in self.folders.keys():
+            self.folders[folder] = load(os.path.join(folder, self.name))
+            if self.name != MANIFEST:
+                self.bases[folder] = load(os.path.join(folder, MANIFEST))['outputs']
+        return self.folders[folder]
+
+    # The modification time and size of a file, or None if it doesn't exist.
+    def signature(self, path):
+
+        if path not in self.signatures.keys():
+            try:
+                stat = os.stat(path)
+                self.signatures[path] = [stat.st_mtime_ns, stat.st_size]
+            except OSError:
+                self.signatures[path] = None
+        return self.signatures[path]
+
+    # A value as it goes into the hash. Fonts and images are replaced by their files and signatures.
+    def hash_value(self, value, isfile=False):
+
+        if isinstance(value, ImageFont.FreeTypeFont):
+            return [value.path, value.size, self.signature(value.path)]
+        if isfile and value != '':
+            return [value, self.signature(value)]
+        return value
+
+    # The hash of everything that goes into the export of a row of the plan.
+    def row_hash(self, plan, row):
+
+        content = [plan.arttype, plan.artsize, plan.encoder]
+        for step in plan.steps:
+            args = step.args
+            if step.column is not None:
+                args = (row[step.column],) + args[1:]
+            content.append([step.command, [self.hash_value(arg, step.command in ('overlay', 'boverlay') and i == 0) for i, arg in enumerate(args)]])
+        return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+    # Check if the file was exported from the same inputs before, and still exists.
+    def unchanged(self, fn, key):
+
+        folder = os.path.dirname(fn)
+        name = os.path.basename(fn)
+        outputs = self.folder(folder)['outputs']
+        if name not in outputs.keys() and folder in self.bases.keys():
+            outputs = self.bases[folder]
+        return outputs.get(name) == key and os.path.isfile(fn)
+
+    # Remember the hash of a file that has been exported.
+    def record(self, fn, key):
+
+        self.folder(os.path.dirname(fn))['outputs'][os.path.basename(fn)] = key
+
+    # Write the manifests of all folders that were used.
+    def save(self):
+
+        for folder, data in self.folders.items():
+            save(os.path.join(folder, self.name), data)
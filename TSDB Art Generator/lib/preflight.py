@@ -0,0 +1,76 @@
+'''
+Created on 18 okt. 2026
+
+Checking the files of a batch before it's rendered. Every path is only checked once, however many rows use it, and
+the paths are checked by a pool of threads, as on network storage most of the time goes into waiting for the server.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os, stat
+
+
+# Paths are checked one by one below this number, as starting the threads would take longer than checking them.
+THREADED = 64
+
+
+# The paths that have been checked, with the mode of each path, or None if it doesn't exist.
+class Preflight:
+
+    def __init__(self, threads=16):
+
+        self.threads = threads
+        self.modes = {}
+
+    @staticmethod
+    def mode(path):
+
+        try:
+            return os.stat(path).st_mode
+        except (OSError, ValueError):
+            return None
+
+    # Check all paths that haven't been checked yet, each of them only once.
+    def check(self, paths):
+
+        todo = [path for path in set(paths) if path not in self.modes.keys()]
+        if len(todo) < THREADED or self.threads <= 1:
+            for path in todo:
+                self.modes[path] = self.mode(path)
+            return
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for path, mode in zip(todo, pool.map(self.mode, todo)):
+                self.modes[path] = mode
+
+    def isfile(self, path):
+
+        self.check([path])
+        return self.modes[path] is not None and stat.S_ISREG(self.modes[path])
+
+    def isdir(self, path):
+
+        self.check([path])
+        return self.modes[path] is not None and stat.S_ISDIR(self.modes[path])
+
+
+# The duplicates among the values, in the order in which they first repeat, each only once.
+def duplicates(values):
+
+    seen = set()
+    found = {}
+    for value in values:
+        if value in seen:
+            found[value] = None
+        seen.add(value)
+    return list(found)
+
+
+# A single error for all problems that were found, listing at most limit of them. Each problem is only listed once.
+def report(problems, limit=20):
+
+    problems = list(dict.fromkeys(problems))
+    if len(problems) == 1:
+        return problems[0]
+    lines = ["{0} problems found:".format(len(problems))] + problems[:limit]
+    if len(problems) > limit:
+        lines.append("... and {0} more".format(len(problems) - limit))
+    return "\n".join(lines)
@@ -0,0 +1,218 @@
+'''
+Created on 18 okt. 2026
+
+Timing of each stage of rendering, to find out where the time of a batch goes.
+
+When enabled, the functions of the stages in lib.artworks are replaced by wrappers that time every call, so nothing
+is timed or counted at all while profiling is disabled. For every stage the number of calls, the total time and the
+time spent in the stage itself (without the stages it calls) are kept. Each command type is timed separately, as are
+the rows. The images Pillow allocates are counted as well, by wrapping the functions of Pillow that return a new
+image, and counting the images of the size of an artwork. These are the canvases that are copied or converted.
+'''
+
+from functools import wraps
+from PIL import Image
+from threading import Lock, local
+import inspect, os, time
+
+
+# The functions that are timed, and the name of their stage in the report.
+stages = {
+    'check_csv'        : 'csv',
+    'check_csv_headers': 'csv',
+    'stream_csv'       : 'csv',
+    'check_files'      : 'preflight',
+    'check_row'        : 'preflight',
+    'compile_job'      : 'compile',
+    'build_record'     : 'build_record',
+    'precompose'       : 'precompose',
+    'add_overlay'      : 'add_overlay',
+    'add_text'         : 'add_text',
+    'drop_shadow'      : 'drop_shadow',
+    'place'            : 'composite',
+    'save_art'         : 'encode',
+    'copy_art'         : 'copy',
+    'render_task'      : 'row'
+    }
+
+# The methods of Pillow images that return a new image, which are wrapped to count the canvases, along with Image.new.
+allocators = ['copy', 'convert', 'crop', 'filter', 'resize', 'rotate']
+arttypes = ['poster', 'thumb', 'banner', 'square']
+
+enabled = False
+lock = Lock()
+threads = local()  # The stack of running stages of each thread, to subtract the time of inner stages.
+originals = {}
+pillow = {}        # The original functions of Pillow, by name, while they're wrapped.
+stats = {}
+rows = []
+counts = {'canvases': 0}
+workers = {}       # The latest report of each worker process, by process id.
+
+
+# Add a call of a stage to the stats.
+def record(stage, elapsed, inner):
+
+    with lock:
+        if stage not in stats.keys():
+            stats[stage] = {'calls': 0, 'seconds': 0.0, 'self': 0.0}
+        stats[stage]['calls'] += 1
+        stats[stage]['seconds'] += elapsed
+        stats[stage]['self'] += elapsed - inner
+        if stage == 'row':
+            rows.append(elapsed)
+
+
+# Time a call of func as stage, keeping the time of stages that are called from it apart.
+def timed_call(stage, func, args, kwargs):
+
+    if not hasattr(threads, 'stack'):
+        threads.stack = []
+    threads.stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        inner = threads.stack.pop()
+        if len(threads.stack) > 0:
+            threads.stack[-1] += elapsed
+        record(stage, elapsed, inner)
+
+
+def wrap(artworks, name, stage):
+
+    func = getattr(artworks, name)
+    if name not in originals.keys():
+        originals[name] = func
+    if inspect.isgeneratorfunction(func): # Time each row that is read, rather than creating the generator.
+        @wraps(func)
+        def timed(*args, **kwargs):
+            items = func(*args, **kwargs)
+            while True:
+                try:
+                    yield timed_call(stage, next, (items,), {})
+                except StopIteration:
+                    return
+    else:
+        @wraps(func)
+        def timed(*args, **kwargs):
+            return timed_call(stage, func, args, kwargs)
+    setattr(artworks, name, timed)
+
+
+# Count the images of one of the sizes that func returns. Images that Pillow allocates inside another wrapped call,
+# such as the copy convert makes when the mode doesn't change, are part of that call and aren't counted again.
+def count_canvases(func, sizes):
+
+    @wraps(func)
+    def counted(*args, **kwargs):
+        if getattr(threads, 'allocating', False):
+            return func(*args, **kwargs)
+        threads.allocating = True
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            threads.allocating = False
+        if isinstance(result, Image.Image) and result.size in sizes:
+            with lock:
+                counts['canvases'] += 1
+        return result
+    return counted
+
+
+# Time each step rendered for a row by its command, such as overlay or btext.
+def wrap_commands(artworks):
+
+    func = artworks.render_steps
+    originals['render_steps'] = func
+    @wraps(func)
+    def timed(art, steps, row):
+        for step in steps:
+            art = timed_call('command.' + step.command, func, (art, (step,), row), {})
+        return art
+    artworks.render_steps = timed
+
+
+# Start timing the stages. Plans should be compiled after this, as they hold on to the functions of their commands.
+# The wrappers keep the names of the functions they wrap, so plans can still be sent to worker processes.
+def enable():
+
+    global enabled
+    if enabled:
+        return
+    import lib.artworks as artworks # Imported here, as lib.artworks uses this module as well.
+    sizes = set(tuple(artworks.art_size(arttype)) for arttype in arttypes)
+    pillow['new'] = Image.new
+    Image.new = count_canvases(Image.new, sizes)
+    for name in allocators:
+        pillow[name] = getattr(Image.Image, name)
+        setattr(Image.Image, name, count_canvases(pillow[name], sizes))
+    for name, stage in stages.items():
+        wrap(artworks, name, stage)
+    wrap_commands(artworks)
+    enabled = True
+
+
+# Stop timing, and put the original functions back.
+def disable():
+
+    global enabled
+    import lib.artworks as artworks
+    for name, func in originals.items():
+        setattr(artworks, name, func)
+    originals.clear()
+    for name, func in pillow.items():
+        setattr(Image if name == 'new' else Image.Image, name, func)
+    pillow.clear()
+    enabled = False
+
+
+def reset():
+
+    with lock:
+        stats.clear()
+        rows.clear()
+        counts['canvases'] = 0
+        workers.clear()
+
+
+def percentile(values, pct):
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+# The report of this process only, which is what worker processes send back.
+def snapshot():
+
+    with lock:
+        return {'stages': {stage: dict(values) for stage, values in stats.items()}, 'rows': list(rows), 'canvases': counts['canvases']}
+
+
+# Keep the latest report of a worker process, to be combined with the others in report.
+def merge_worker(pid, report):
+
+    with lock:
+        workers[pid] = report
+
+
+# The report of this process and all worker processes combined, with the row latency percentiles in milliseconds.
+def report():
+
+    result = {'stages': {}, 'canvases': 0}
+    latencies = []
+    for part in [snapshot()] + list(workers.values()):
+        for stage, values in part['stages'].items():
+            if stage not in result['stages'].keys():
+                result['stages'][stage] = {'calls': 0, 'seconds': 0.0, 'self': 0.0}
+            for key in values:
+                result['stages'][stage][key] += values[key]
+        latencies.extend(part['rows'])
+        result['canvases'] += part['canvases']
+    result['rows'] = {'count': len(latencies)}
+    if len(latencies) > 0:
+        for name, pct in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+            result['rows'][name] = percentile(latencies, pct) * 1000
+    result['processes'] = [os.getpid()] + list(workers)
+    return result
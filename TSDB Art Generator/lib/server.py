@@ -0,0 +1,233 @@
+'''
+Created on 18 okt. 2026
+
+A render server, which keeps running between jobs so the loaded fonts, overlays and compiled templates stay in memory.
+It listens on a local HTTP port, and renders on a pool of threads. The following requests are handled:
+
+POST /job     <- Runs a job, as found in the "job" of a job file. The body is {"job": {"Jobtype": {...}}}, or a list of
+                 these. Returns the result of each job: the exported files, the errors and the number of rows rendered.
+POST /row     <- Renders a single row with a template, which is a job without a csvfile. The body is
+                 {"template": {"Jobtype": {...}}, "row": {"column": "value", ...}}, and optionally "encoder" with a
+                 profile name or settings, and "return": "image" to get the encoded image back instead of writing it to
+                 the file in the fnexp column. Returns {"art": filename, "messages": [...]} or the image.
+GET /metrics  <- The number of requests, errors and rendered images, the latency of the requests, and the cache stats.
+
+Errors are returned as {"error": "..."} with status 400.
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+import io, json, os, os.path, time
+import lib.artworks as artworks
+import lib.cache as cache
+import lib.profiling as profiling
+
+
+# Compiled templates with their static layers, by the template, the columns of the row, the encoder, and the
+# modification time of the files used by the template, so a changed overlay or font compiles the template again.
+templates = cache.LRUCache(64)
+
+mimetypes = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+
+
+class Metrics:
+
+    def __init__(self, latencies=1000):
+
+        self.started = time.time()
+        self.requests = {}
+        self.errors = 0
+        self.rendered = 0
+        self.latencies = deque(maxlen=latencies) # Only the latest requests, so the percentiles follow the load.
+        self.lock = Lock()
+
+    def record(self, path, seconds, rendered, error):
+
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.latencies.append(seconds)
+            self.rendered += rendered
+            if error:
+                self.errors += 1
+
+    def report(self):
+
+        with self.lock:
+            uptime = time.time() - self.started
+            result = {
+                'uptime'   : uptime,
+                'requests' : dict(self.requests),
+                'errors'   : self.errors,
+                'rendered' : self.rendered,
+                'per_sec'  : self.rendered / uptime if uptime > 0 else 0.0,
+                'latency_ms': {}
+                }
+            if len(self.latencies) > 0:
+                for name, pct in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+                    result['latency_ms'][name] = profiling.percentile(self.latencies, pct) * 1000
+        result['cache'] = cache.stats()
+        result['cache']['templates'] = templates.stats()
+        return result
+
+
+# The files a template uses for all rows, with their modification time, or None if they don't exist.
+def template_files(job):
+
+    files = []
+    for command in job.get('commands', []):
+        ctype = list(command)[0]
+        if ctype == 'overlay':
+            files.append(command[ctype].get('image'))
+        elif ctype in ('text', 'btext'):
+            files.append(command[ctype].get('font'))
+    return [[fn, os.path.getmtime(fn) if isinstance(fn, str) and os.path.isfile(fn) else None] for fn in files]
+
+
+# The compiled plan and static layers of a template, compiled the first time the template is used with these columns.
+def prepare_template(arttype, job, headers, encoder):
+
+    key = json.dumps([arttype, job, headers, encoder, template_files(job)], sort_keys=True)
+    target = templates.get(key)
+    if target is not None:
+        return target
+    artsize = artworks.art_size(arttype)
+    if artsize is None:
+        return {'error': "'{0}' is not a valid art type".format(arttype)}
+    compiled = artworks.compile_job(arttype, artsize, job, headers, encoder)
+    if 'error' in compiled.keys():
+        return compiled
+    target = {'plan': compiled['plan'], 'layers': artworks.precompose(compiled['plan']), 'messages': compiled['messages']}
+    return templates.put(key, target)
+
+
+# Render a single row with a template. Returns the result, with the encoded image if it's returned instead of written.
+def render_row(request, encoder=None):
+
+    if not isinstance(request.get('template'), dict) or len(request['template']) != 1 or not isinstance(request.get('row'), dict):
+        return {'error': "A row request needs a template with one job type, and a row with a value for each column."}
+    arttype = list(request['template'])[0].lower()
+    job = request['template'][list(request['template'])[0]]
+    image = request.get('return', 'path') == 'image'
+    if not image and 'fnexp' not in job.keys():
+        return {'error': "No fnexp in the template. Give the file to export to, or use \"return\": \"image\"."}
+    headers = list(request['row'])
+    row = ["{0}".format(request['row'][header]) for header in headers]
+
+    # Check the files of this row. The export folder doesn't matter if the image is returned.
+    checkjob = {key: value for key, value in job.items() if not (image and key == 'fnexp')}
+    chk = artworks.check_files(checkjob, {header: [value] for header, value in zip(headers, row)})
+    if 'error' in chk.keys():
+        return chk
+    target = prepare_template(arttype, job, headers, request.get('encoder', encoder))
+    if 'error' in target.keys():
+        return target
+    plan = target['plan']
+    if not image: # The file it's written to should have the extension of the format.
+        error = artworks.check_extension(row[plan.column] if plan.column is not None else plan.fnexp, plan.encoder)
+        if error is not None:
+            return {'error': error}
+    task = artworks.render_task(plan, target['layers'], 0, row, not image)
+    if 'error' in task.keys():
+        return {'error': task['error']}
+    result = {'art': task['art'], 'messages': target['messages'] + task['messages']}
+    if image:
+        fp = io.BytesIO()
+        artworks.encode_art(task['image'], fp, plan.encoder)
+        result['image'] = fp.getvalue()
+        result['mimetype'] = mimetypes[plan.encoder.format]
+    return result
+
+
+# Run one or more jobs, as in a job file. Returns the result of each job.
+def render_job(request, encoder=None):
+
+    jobs = request.get('job')
+    if isinstance(jobs, dict):
+        jobs = [jobs]
+    if not isinstance(jobs, list) or len(jobs) == 0 or not all(isinstance(job, dict) and len(job) == 1 for job in jobs):
+        return {'error': "A job request needs a job, with one job type for each job."}
+    return {'results': [artworks.generate_art(job, writers=0, encoder=encoder) for job in jobs]}
+
+
+class RenderServer(ThreadingHTTPServer):
+
+    def __init__(self, address, workers=1, encoder=None):
+
+        super().__init__(address, RenderHandler)
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.metrics = Metrics()
+        self.encoder = encoder
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+
+    def send_body(self, status, body, mimetype):
+
+        self.send_response(status)
+        self.send_header('Content-Type', mimetype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+
+        self.send_body(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+
+        if self.path == '/metrics':
+            self.send_json(200, self.server.metrics.report())
+        else:
+            self.send_json(404, {'error': "Unknown request {0}".format(self.path)})
+
+    def do_POST(self):
+
+        start = time.perf_counter()
+        match self.path:
+            case '/job':
+                func = render_job
+            case '/row':
+                func = render_row
+            case _:
+                self.send_json(404, {'error': "Unknown request {0}".format(self.path)})
+                return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            result = {'error': "The request should be a json object."}
+        else:
+            try:
+                result = self.server.pool.submit(func, request, self.server.encoder).result()
+            except Exception as e:
+                result = {'error': "{0}".format(e)}
+        rendered = 0
+        if 'results' in result.keys():
+            rendered = sum(job.get('rendered', 0) for job in result['results'])
+        elif 'art' in result.keys():
+            rendered = 1
+        self.server.metrics.record(self.path, time.perf_counter() - start, rendered, 'error' in result.keys())
+        if 'error' in result.keys():
+            self.send_json(400, result)
+        elif 'image' in result.keys():
+            self.send_body(200, result['image'], result['mimetype'])
+        else:
+            self.send_json(200, result)
+
+
+# Run the server on host and port until it's interrupted. Encoder overrides the encoder settings of all requests
+# that don't give their own.
+def serve(host, port, workers=1, encoder=None):
+
+    server = RenderServer((host, port), workers, encoder)
+    print("Serving on http://{0}:{1} with {2} worker thread(s)".format(host, server.server_address[1], max(workers, 1)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
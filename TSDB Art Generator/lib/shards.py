@@ -0,0 +1,77 @@
+'''
+Created on 18 okt. 2026
+
+Summaries of the shards of a job file. A large batch can be split over several runs, on several machines sharing the
+export folders, by running the same job file with --shard 1/N up to --shard N/N. Each shard writes a summary of its
+results next to the job file, and when all shards are done, merge combines the summaries into one report and the
+manifests of the shards into the manifest of each export folder.
+'''
+
+import json, os, os.path
+import lib.manifest as manifest
+
+
+# The filename of the summary of a shard of a job file, where index counts from 1 to count.
+def summary_name(filename, index, count):
+
+    return "{0}.shard-{1}-of-{2}.json".format(os.path.splitext(filename)[0], index, count)
+
+
+# The filename of the report merged from all shards of a job file.
+def report_name(filename):
+
+    return "{0}.shards.json".format(os.path.splitext(filename)[0])
+
+
+# Write the summary of a shard, with the results of each job in the job file.
+def write_summary(filename, shard, jobs, arts):
+
+    summary = {'shard': list(shard), 'jobs': []}
+    for job, art in zip(jobs, arts):
+        entry = {'job': list(job)[0].lower()}
+        if 'error' in art.keys():
+            entry['error'] = art['error']
+        else:
+            entry.update({key: art[key] for key in ('rendered', 'skipped', 'deduplicated', 'othershards', 'encoder')})
+            entry['errors'] = art.get('errors', [])
+            entry['folders'] = sorted(set(os.path.dirname(fn) for fn in art.get('art', [])))
+        summary['jobs'].append(entry)
+    with open(summary_name(filename, *shard), 'w') as fp:
+        json.dump(summary, fp, indent=1)
+    return summary_name(filename, *shard)
+
+
+# Combine the summaries of all shards of a job file into one report, and merge the manifests of the shards in the
+# export folders. Returns the report, or an error if any shard hasn't written its summary.
+def merge(filename, count):
+
+    summaries = []
+    for index in range(1, count + 1):
+        name = summary_name(filename, index, count)
+        if not os.path.isfile(name):
+            return {'error': "The summary of shard {0}/{1} ({2}) was not found. Make sure all shards are done.".format(index, count, name)}
+        with open(name, 'r') as fp:
+            summaries.append(json.load(fp))
+    report = {'shards': count, 'jobs': []}
+    for entries in zip(*[summary['jobs'] for summary in summaries]):
+        job = {'job': entries[0]['job'], 'rendered': 0, 'skipped': 0, 'deduplicated': 0, 'othershards': 0, 'errors': [], 'folders': [],
+               'encoder': {'files': 0, 'seconds': 0.0, 'bytes': 0}}
+        for entry in entries:
+            if 'error' in entry.keys(): # The whole job failed, which happens the same way in every shard.
+                job = {'job': entry['job'], 'error': entry['error']}
+                break
+            for key in ('rendered', 'skipped', 'deduplicated', 'othershards'):
+                job[key] += entry[key]
+            job['errors'].extend(entry['errors'])
+            job['folders'] = sorted(set(job['folders']) | set(entry['folders']))
+            for key in job['encoder']:
+                job['encoder'][key] += entry['encoder'][key]
+        report['jobs'].append(job)
+    report['manifests'] = 0
+    for folder in sorted(set(folder for job in report['jobs'] for folder in job.get('folders', []))):
+        report['manifests'] += manifest.merge_shards(folder, count)
+    with open(report_name(filename), 'w') as fp:
+        json.dump(report, fp, indent=1)
+    for index in range(1, count + 1):
+        os.remove(summary_name(filename, index, count))
+    return report
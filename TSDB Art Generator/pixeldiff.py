@@ -0,0 +1,184 @@
+'''
+Created on 18 okt. 2026
+
+Pixel-diff checks of the rendering pipeline against the way the SportsDB Art Generator used to render.
+
+The old implementations are kept here as references. Each check renders the same layers through the old and the
+current code onto the same background, and compares the results channel by channel. A check fails if the largest
+difference, or the number of pixels that differ by more than a few levels, exceeds the bound set for it.
+
+Checks:
+- shadow: drop shadows, blurred once with GaussianBlur around the text, against the old shadows that were blurred
+  seven times with ImageFilter.BLUR over the whole canvas, at whole and fractional positions. Only text that lies
+  completely inside the artwork is compared, as the old shadows were cut off at the edge of the canvas before blurring.
+- text: unrotated text, drawn and smoothed in a box around the text, against the old text that was drawn, rotated
+  and smoothed on a layer the size of the artwork. These only differ in rounding.
+- rotated: the same for rotated text. The box is rotated around the same pivot as the old layer, but Pillow rounds
+  the position of some pixels on the edge of the strokes differently when the pivot lies elsewhere in the image. A
+  few of those pixels end up with the color of their neighbour, so a small number of pixels may differ a lot: up to
+  1.5% of the pixels of the text may differ by more than 8 levels. The text is rotated around the center of the
+  artwork, and only when it stays inside the artwork at any angle, as the old layer was cut off at its edges.
+
+Uses the TrueType font bundled with Pillow, so it doesn't need any Art Elements.
+
+Usage:
+    python pixeldiff.py
+    python pixeldiff.py --checks shadow,rotated
+'''
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont
+import argparse, itertools, sys
+import lib.artworks as artworks
+
+
+sizes = {'poster': [680, 1000], 'thumb': [1280, 720], 'banner': [1000, 185], 'square': [700, 700]}
+background = (200, 180, 160, 255)
+text = 'TheSportsDB Team'
+
+# The differences allowed by each check: the largest difference of a channel, and the number of pixels that may differ
+# by more than the threshold, either as a number or as a share of the pixels drawn by the old code.
+# The fractions added to the position of the text, as a position such as [100.5, 200.25] is valid in a job file.
+fractions = [[0, 0], [0.5, 0.25]]
+
+bounds = {
+    'shadow' : {'max': 4, 'threshold': 2, 'pixels': 1000},
+    'text'   : {'max': 1, 'threshold': 1, 'pixels': 0},
+    'rotated': {'max': 255, 'threshold': 8, 'share': 0.015}
+    }
+
+
+# The old drop shadow: drawn on a layer the size of the artwork, blurred seven times and rotated around pos.
+def old_drop_shadow(art, pos, text, color, font, anchor, rotation):
+
+    drop = Image.new('RGBA', art.size)
+    draw = ImageDraw.Draw(drop)
+    draw.text(pos, text, fill=tuple(color), font=font, anchor=anchor)
+    for i in range(7):
+        drop = drop.filter(ImageFilter.BLUR)
+    drop = drop.rotate(angle=rotation, center=pos)
+    return drop
+
+
+# The old text layer: drawn on a layer the size of the artwork, rotated around pos, and smoothed by resizing the whole
+# layer to twice its size and back.
+def old_add_text(art, text, font, anchor, pos, rotation, stroke, color, fill):
+
+    textimage = Image.new('RGBA', art.size)
+    ol = ImageDraw.Draw(textimage)
+    ol.text(pos, text, fill=tuple(fill), font=font, anchor=anchor, stroke_width=stroke, stroke_fill=tuple(color))
+    textimage = textimage.rotate(angle=rotation, center=pos)
+    textimage = textimage.resize([textimage.width * 2, textimage.height * 2], resample=Image.Resampling.LANCZOS)
+    textimage = textimage.resize([textimage.width // 2, textimage.height // 2], resample=Image.Resampling.LANCZOS)
+    art.paste(textimage, textimage)
+    return art
+
+
+def fraction_name(offset):
+
+    return " +{0},{1}".format(*offset) if any(offset) else ""
+
+
+# The largest difference of any channel, the number of pixels that differ by more than threshold, and the number of
+# pixels the old code drew over the background.
+def difference(old, new, threshold):
+
+    levels = largest_band(ImageChops.difference(old.convert('RGB'), new.convert('RGB'))).histogram()
+    drawn = largest_band(ImageChops.difference(old.convert('RGB'), Image.new('RGB', old.size, background[:3]))).histogram()
+    return max(level for level in range(256) if levels[level] > 0), sum(levels[threshold + 1:]), sum(drawn[1:])
+
+
+# The largest of the channels of each pixel.
+def largest_band(img):
+
+    r, g, b = img.split()
+    return ImageChops.lighter(ImageChops.lighter(r, g), b)
+
+
+# A position for the text that keeps it, and everything around it up to margin, inside the artwork.
+def text_pos(artsize, font, margin):
+
+    left, top, right, bottom = font.getbbox(text, anchor='ls')
+    return [max(margin - left, (artsize[0] - right + left) // 2 - left), max(margin - top, (artsize[1] - bottom + top) // 2 - top)]
+
+
+# Compare the shadows of the old and the current code for each art type and font size, without any text on top.
+# Each is also compared at a fractional position, which is valid in a job file.
+def check_shadow():
+
+    cases = []
+    for arttype, artsize in sizes.items():
+        for size in (12, 24, 40, 72):
+            font = ImageFont.load_default(size)
+            for offset in fractions:
+                pos = [value + part for value, part in zip(text_pos(artsize, font, 20), offset)]
+                old = Image.new('RGBA', artsize, background)
+                drop = old_drop_shadow(old, pos, text, (0, 0, 0), font, 'ls', 0)
+                old.paste(drop, drop)
+                new = Image.new('RGBA', artsize, background)
+                drop, origin = artworks.drop_shadow(pos, text, (0, 0, 0), font, 'ls', 0, 4.4)
+                new = artworks.place(new, drop, origin)
+                cases.append(("{0} {1}pt{2}".format(arttype, size, fraction_name(offset)), old, new))
+    return cases
+
+
+# Compare the text of the old and the current code for each art type, font size, rotation and stroke, at whole and
+# fractional positions.
+def text_cases(rotations):
+
+    cases = []
+    for arttype, artsize in sizes.items():
+        for size in (16, 24, 40, 72):
+            font = ImageFont.load_default(size)
+            for rotation, stroke, offset in itertools.product(rotations, (0, 3), fractions):
+                pos = text_pos(artsize, font, 10)
+                if rotation != 0: # Rotate around the center, and only if the text stays inside at any angle.
+                    pos = [artsize[0] // 2, artsize[1] // 2]
+                pos = [value + part for value, part in zip(pos, offset)]
+                if rotation != 0:
+                    boxsize, origin, textpos = artworks.text_box(pos, text, font, 'ls', rotation, 4, stroke)
+                    if min(origin) < 0 or origin[0] + boxsize[0] > artsize[0] or origin[1] + boxsize[1] > artsize[1]:
+                        continue
+                args = (text, font, 'ls', pos, rotation, stroke, (0, 0, 0), (255, 255, 0))
+                old = old_add_text(Image.new('RGBA', artsize, background), *args)
+                new = artworks.add_text(Image.new('RGBA', artsize, background), *args, False, (0, 0, 0), 4.4)
+                cases.append(("{0} {1}pt {2}deg s{3}{4}".format(arttype, size, rotation, stroke, fraction_name(offset)), old, new))
+    return cases
+
+
+def check_text():
+
+    return text_cases([0])
+
+
+def check_rotated():
+
+    return text_cases([10, -30, 45, 90, 180, 277])
+
+
+checks = {'shadow': check_shadow, 'text': check_text, 'rotated': check_rotated}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the rendering pipeline with the old implementations, pixel by pixel")
+    parser.add_argument('--checks', default=','.join(checks), help="Comma separated checks to run (default all)")
+    args = parser.parse_args()
+    if not isinstance(ImageFont.load_default(10), ImageFont.FreeTypeFont):
+        sys.exit("This Pillow has no FreeType support, so there's no TrueType font to check with.")
+    failed = 0
+    for name in [name.strip() for name in args.checks.split(',')]:
+        if name not in checks.keys():
+            parser.error("'{0}' is not a valid check".format(name))
+        bound = bounds[name]
+        for case, old, new in checks[name]():
+            largest, pixels, drawn = difference(old, new, bound['threshold'])
+            share = pixels / drawn if drawn > 0 else 0.0
+            ok = largest <= bound['max'] and pixels <= bound.get('pixels', pixels) and share <= bound.get('share', share)
+            if not ok:
+                failed += 1
+            print("{0:7} {1:28} max {2:3}, {3:5} pixels over {4} ({5:.2%} of {6})  {7}".format(
+                name, case, largest, pixels, bound['threshold'], share, drawn, "ok" if ok else "FAILED"))
+    if failed > 0:
+        print("{0} case(s) failed".format(failed))
+        sys.exit(1)
+    print("All cases within bounds")
+    sys.exit(0)
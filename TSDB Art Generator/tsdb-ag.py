@@ -21,6 +21,7 @@ The JSON structure is as follows:
     "Jobtype": { <- Jobtype is one of "Poster", "Thumb", "Banner", or "Square" to create files of this type.
         "csvfile": "x" <- Name of the csvfile for batch processing. Optional. Treats BOverlay as Overlay if ommitted.
         "fnexp"  : "y" <- Name of the exported file or name of the column for the filename in the csv if csvfile above is used.
+        "encoder": "z" <- How the files are exported. Optional. Either the name of a profile or the settings as shown below.
         "commands": [{ <- One of the commands mentioned above. Each command has a structure as explained below.
         }]
     }]
@@ -49,20 +50,146 @@ Text and BText:
         "fill"    : [0,0,0],                    <- The fill color of the text. White (255,255,255) is the default.
         "drop"    : "true",                     <- Should the text contain a drop shadow?
         "dcol"    : [0,0,0],                    <- Color of the drop shadow. Black (0,0,0) is the default.
+        "blur"    : 4.4,                        <- The blur radius of the drop shadow. Defaults to 4.4.
+    }
+
+Encoder settings are as follows. The profiles are "default" (the defaults below), "draft" (quality 80, no optimize)
+and "final" (quality 95, optimize and progressive).
+    {
+        "format"      : "jpeg",                 <- The format of the exported files (jpeg, png or webp). Defaults to jpeg.
+                                                   The export filenames should have the extension of the format.
+        "quality"     : 95,                     <- The quality (1-100) for jpeg and webp. Defaults to 95.
+        "optimize"    : true,                   <- Spend extra time to make the files smaller. Defaults to true.
+        "progressive" : false,                  <- Export progressive jpeg files. Defaults to false.
+        "subsampling" : "default",              <- Chroma subsampling for jpeg (4:4:4, 4:2:2 or 4:2:0). Defaults to Pillow's choice.
     }
     
+Command line options:
+    --workers N     <- Render the rows of a batch using N worker processes. The output is the same as a single process run.
+    --stream        <- Read the rows of the CSV one at a time while rendering, instead of reading and checking the whole
+                       file up front. Rows with missing files or duplicate export filenames are skipped and reported.
+    --incremental   <- Only render the rows whose commands, images or fonts changed since the last run. A manifest with
+                       a hash of the inputs of each exported file is kept in each export folder.
+    --writers N     <- Number of background threads that encode and write the exports while the next rows are rendered
+                       (default 1). With 0, each export is written before the next row is rendered.
+    --queue N       <- Number of rendered images that may wait to be written before rendering waits (default 4).
+    --multi         <- Render the jobs that use the same CSV together. The CSV is read and checked once, and each row
+                       is rendered for all of these jobs before moving on to the next row, sharing loaded overlays and fonts.
+    --encoder SPEC  <- Override the encoder settings of all jobs, with a profile name or settings such as
+                       "format=webp,quality=80". The encode time and bytes written are shown for each profile.
+    --profile FILE  <- Time each stage (reading the CSV, checking files, compiling, overlays, text, drop shadows and
+                       encoding), each command type and each row, and count the canvas sized images that are allocated.
+                       The report is written to FILE as JSON, and the stages that took longest are shown.
+    --no-dedup      <- Render every row, also rows that only differ in their export filename. By default these are
+                       rendered once, and the export is hard linked (or copied) to the filenames of the other rows.
+    --shard I/N     <- Only render the exports of shard I of N (counting from 1), to spread a batch over several runs or
+                       machines sharing the export folders. Exports are divided by their filename, so each shard always
+                       gets the same exports. The whole CSV is still checked by each shard. Each shard writes a summary
+                       next to the job file, and with --incremental its own manifest in each export folder.
+    --merge-shards N <- Once all N shards are done, combine their summaries into one report (written next to the job
+                       file) and merge their manifests into the manifest of each export folder. Doesn't render anything.
+    --serve ADDRESS <- Run a render server on a local port ("8080" or "127.0.0.1:8080") instead of a job file, which keeps
+                       fonts, overlays and compiled templates in memory between requests. Requests are rendered by
+                       --workers threads. See lib/server.py for the requests it handles.
+    --cprofile FILE <- Run the jobs under cProfile and write the stats to FILE, to be read with pstats or snakeviz.
+                       Only covers the main process, so run it without --workers to see the rendering.
+
 '''
 
-import os, os.path, argparse, csv, json, sys
+import os, os.path, argparse, cProfile, csv, json, sys
 import lib.artworks as artworks
+import lib.profiling as profiling
+import lib.server as server
+import lib.shards as shards
+
+
+# Parse the encoder option, which is either a profile name or comma separated settings like "format=webp,quality=80".
+def parse_encoder(spec):
+    
+    if '=' not in spec:
+        return spec
+    settings = {}
+    for setting in spec.split(','):
+        key, _, value = setting.partition('=')
+        value = value.strip()
+        if value.lower() in ('true', 'false'):
+            settings[key.strip()] = value.lower() == 'true'
+        elif value.isdigit():
+            settings[key.strip()] = int(value)
+        else:
+            settings[key.strip()] = value
+    return settings
+
+
+# Parse the shard option, given as "I/N" for shard I of N shards.
+def parse_shard(spec):
+    
+    index, _, count = spec.partition('/')
+    if not (index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count)):
+        raise argparse.ArgumentTypeError("'{0}' is not a valid shard, use I/N with I from 1 to N".format(spec))
+    return (int(index), int(count))
+
+
+# Merge the summaries of all shards of a job file, and print the combined report.
+def merge_shards(filename, count):
+    
+    report = shards.merge(filename, count)
+    if 'error' in report.keys():
+        print(report['error'])
+        return 1
+    for job in report['jobs']:
+        if 'error' in job.keys():
+            print("Job {0} failed: {1}".format(job['job'], job['error']))
+            continue
+        print("{0}: rendered {1}, skipped {2} unchanged, linked {3} identical, {4} row(s) failed, {5} files, {6} bytes written".format(
+            job['job'], job['rendered'], job['skipped'], job['deduplicated'], len(job['errors']), job['encoder']['files'], job['encoder']['bytes']))
+        for error in job['errors']:
+            print(error)
+    print("Merged {0} shard manifest(s), report written to {1}".format(report['manifests'], shards.report_name(filename)))
+    return 0
+
+
+# Write the profile report, and print the stages that took longest by the time spent in the stage itself, and the
+# commands that took longest including the stages they use.
+def write_profile(filename):
+    
+    report = profiling.report()
+    with open(filename, 'w') as fp:
+        json.dump(report, fp, indent=1, sort_keys=True)
+    print("Profile written to {0}".format(filename))
+    stages = [item for item in report['stages'].items() if not item[0].startswith('command.')]
+    commands = [item for item in report['stages'].items() if item[0].startswith('command.')]
+    for stage, stats in sorted(stages, key=lambda item: item[1]['self'], reverse=True) + sorted(commands, key=lambda item: item[1]['seconds'], reverse=True):
+        print("  {0:18} {1:8.3f}s self {2:8.3f}s total {3:7} calls".format(stage, stats['self'], stats['seconds'], stats['calls']))
+    if report['rows']['count'] > 0:
+        print("  {0} rows, p50 {1:.1f}ms, p99 {2:.1f}ms, {3} canvas images allocated".format(report['rows']['count'], report['rows']['p50'], report['rows']['p99'], report['canvases']))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="A simple tool to generate artwork for TheSportsDB.com")
-    parser.add_argument('filename', help="Filename for the json file (required)")
+    parser.add_argument('filename', nargs='?', help="Filename for the json file (required unless serving)")
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help="Number of worker processes used to render batch rows (default 1)")
+    parser.add_argument('--stream', action='store_true', help="Read and check the CSV one row at a time while rendering, for very large CSV files")
+    parser.add_argument('--incremental', action='store_true', help="Skip the rows whose inputs haven't changed since the last run")
+    parser.add_argument('--writers', type=int, default=1, metavar='N', help="Number of background threads that encode and write exports (default 1, 0 to write in between rows)")
+    parser.add_argument('--queue', type=int, default=4, metavar='N', help="Number of rendered images that may wait to be written (default 4)")
+    parser.add_argument('--multi', action='store_true', help="Render the jobs that use the same CSV together, in a single pass over the CSV")
+    parser.add_argument('--encoder', type=parse_encoder, metavar='SPEC', help="Encoder profile (default, draft, final) or settings like format=webp,quality=80")
+    parser.add_argument('--profile', metavar='FILE', help="Time each stage, command and row, and write the report to FILE as JSON")
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false', help="Render rows that only differ in their export filename again, instead of linking")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N', help="Only render the exports of shard I of N")
+    parser.add_argument('--merge-shards', type=int, metavar='N', help="Combine the summaries and manifests of N finished shards")
+    parser.add_argument('--serve', metavar='ADDRESS', help="Run a render server on [host:]port instead of a job file")
+    parser.add_argument('--cprofile', metavar='FILE', help="Run under cProfile and write the stats to FILE")
     args = parser.parse_args()
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        if not port.isdigit():
+            parser.error("{0} is not a valid address to serve on.".format(args.serve))
+        server.serve(host if host else '127.0.0.1', int(port), args.workers, args.encoder)
+        sys.exit(0)
     # Parse the arguments.
-    if not os.path.isfile(args.filename): # If the argument isn't a file.
+    if args.filename is None or not os.path.isfile(args.filename): # If the argument isn't a file.
         parser.error("{0} is not a valid file.".format(args.filename))
         sys.exit(0)
     try:
@@ -76,14 +203,64 @@ if __name__ == '__main__':
         sys.exit(1)
     if not (isinstance(data['job'], list)): # Make sure there's a list of output types. 
         data['job'] = [data['job']] # If it's a single type, make it a list anyway.
-    for arttype in data['job']:
-        print('Processing {0}s'.format(list(arttype)[0].lower()))
-        art = artworks.generate_art(arttype)
+    if args.merge_shards:
+        sys.exit(merge_shards(args.filename, args.merge_shards))
+    options = {'workers': args.workers, 'stream': args.stream, 'incremental': args.incremental, 'writers': args.writers, 'queue': args.queue, 'encoder': args.encoder, 'shard': args.shard, 'dedup': args.dedup}
+    encoders = {} # The encode time and bytes written for each encoder profile.
+    cachenotes = {'fonts': ' (loaded when compiling the job)'}
+    if args.profile:
+        profiling.enable()
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    if args.multi:
+        print('Processing {0}'.format(", ".join('{0}s'.format(list(arttype)[0].lower()) for arttype in data['job'])))
+        arts = artworks.generate_multi(data['job'], **options)
+    else:
+        arts = None
+    results = [] # The result of each job, for the shard summary.
+    for index, arttype in enumerate(data['job']):
+        if arts is None:
+            print('Processing {0}s'.format(list(arttype)[0].lower()))
+            art = artworks.generate_art(arttype, **options)
+        else:
+            art = arts[index]
+        results.append(art)
         if 'error' in art.keys():
             print("Error while parsing job file {0} for job {1}:".format(args.filename, list(arttype)[0]))
             print(art['error'])
             continue
+        if 'errors' in art.keys():
+            print("{0} row(s) failed while exporting {1}s:".format(len(art['errors']), list(arttype)[0].lower()))
+            for error in art['errors']:
+                print(error)
+        print('Rendered {0}, skipped {1} unchanged'.format(art['rendered'], art['skipped']))
+        if art['deduplicated'] > 0:
+            print('Saved {0} render(s) by linking the exports of identical rows'.format(art['deduplicated']))
+        if args.shard:
+            print('Left {0} to the other shards'.format(art['othershards']))
+        profile = art['encoder']['profile']
+        if profile not in encoders.keys():
+            encoders[profile] = {'files': 0, 'seconds': 0.0, 'bytes': 0}
+        for key in encoders[profile]:
+            encoders[profile][key] += art['encoder'][key]
+        together = art.get('together', [index])
+        if index == together[-1]: # Jobs rendered together share their cache stats, so show them after the last of them.
+            if len(together) > 1:
+                print('Cache stats of the {0} rendered together:'.format(", ".join('{0}s'.format(list(data['job'][job])[0].lower()) for job in together)))
+            for name, stats in art['cache'].items():
+                print('{0} cache{1}: {2} hits, {3} misses, {4} evictions'.format(name.rstrip('s').capitalize(), cachenotes.get(name, ''), stats['hits'], stats['misses'], stats['evictions']))
         print('Finished exporting {0}s'.format(list(arttype)[0].lower()))
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        print("cProfile stats written to {0}".format(args.cprofile))
+    if args.shard:
+        print("Shard summary written to {0}".format(shards.write_summary(args.filename, args.shard, data['job'], results)))
+    for profile, stats in encoders.items():
+        print("Encoder {0}: {1} files, {2:.2f}s encoding, {3} bytes written".format(profile, stats['files'], stats['seconds'], stats['bytes']))
+    if args.profile:
+        write_profile(args.profile)
     print("Done processing.")
     sys.exit(0)
                     
\ No newline at end of file